@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Persistent queue of wakeup-alarms multiplexed onto the single alarm of
+# the PCF85063A.
+#
+# The queue is a binary heap ordered by time (seconds since the epoch, UTC)
+# and is stored in a compact binary file:
+#
+#   header: b"RTCQ" + version-byte
+#   record: time (8 bytes, signed, big-endian), length of name (1 byte),
+#           name (utf-8)
+#
+# The hardware alarm only matches day-of-month, hours, minutes and seconds,
+# so it is ambiguous for alarms 28 days or more ahead. These are reached
+# with intermediate wakeups.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, time, heapq, struct
+from datetime import datetime
+
+_MAGIC  = b"RTCQ\x01"
+_RECORD = struct.Struct(">qB")
+
+MAX_DISTANCE = 27*86400            # maximum distance of a hardware alarm
+
+class AlarmQueue(object):
+  """
+  Persistent queue of alarms ordered by time.
+  """
+
+  def __init__(self,path):
+    """ constructor: load queue from the given file (if it exists) """
+    self.path  = path
+    self._heap = []
+    self.load()
+
+  def load(self):
+    """ load the queue from the file """
+    try:
+      with open(self.path,"rb") as f:
+        data = f.read()
+    except FileNotFoundError:
+      self._heap = []
+      return
+    if not data.startswith(_MAGIC):
+      raise ValueError("invalid alarm-file %s" % self.path)
+
+    heap = []
+    pos  = len(_MAGIC)
+    while pos < len(data):
+      when, length = _RECORD.unpack_from(data,pos)
+      pos += _RECORD.size
+      heap.append((when,data[pos:pos+length].decode()))
+      pos += length
+    heapq.heapify(heap)                    # O(n), file is in heap-order
+    self._heap = heap
+
+  def save(self):
+    """ save the queue (atomically replaces the file) """
+    os.makedirs(os.path.dirname(self.path) or ".",exist_ok=True)
+    tmp = self.path + ".tmp"
+    with open(tmp,"wb") as f:
+      f.write(_MAGIC)
+      for when,name in self._heap:
+        name = name.encode()
+        f.write(_RECORD.pack(when,len(name)) + name)
+    os.replace(tmp,self.path)
+
+  def add(self,when,name):
+    """ add an alarm (time in seconds since the epoch) """
+    if len(name.encode()) > 255:
+      raise ValueError("name of alarm is too long (max. 255 bytes)")
+    heapq.heappush(self._heap,(int(when),name))
+
+  def peek(self):
+    """ return the earliest alarm as tuple (time,name) or None """
+    return self._heap[0] if self._heap else None
+
+  def pop(self):
+    """ remove and return the earliest alarm """
+    return heapq.heappop(self._heap)
+
+  def pop_due(self,now):
+    """ remove and return all alarms up to the given time """
+    due = []
+    while self._heap and self._heap[0][0] <= now:
+      due.append(heapq.heappop(self._heap))
+    return due
+
+  def remove(self,name):
+    """ remove all alarms with the given name, return their number """
+    count = len(self._heap)
+    self._heap = [entry for entry in self._heap if entry[1] != name]
+    heapq.heapify(self._heap)
+    return count - len(self._heap)
+
+  def __len__(self):
+    return len(self._heap)
+
+  def __iter__(self):
+    return iter(sorted(self._heap))
+
+# --- programming of the hardware alarm   ----------------------------------
+
+def next_wakeup(queue,now):
+  """
+  Return the time of the next wakeup (seconds since the epoch) for the
+  earliest alarm of the queue or None if the queue is empty. For alarms
+  more than MAX_DISTANCE ahead, this is an intermediate wakeup.
+  """
+  entry = queue.peek()
+  if entry is None:
+    return None
+  return min(entry[0],int(now)+MAX_DISTANCE)
+
+def program(rtc,queue,enable=True):
+  """
+  Drop due alarms from the queue and program the next wakeup into the RTC.
+  Returns a tuple (due,wakeup) with the dropped alarms and the time of the
+  wakeup (None if the queue is empty, the RTC is not changed in this case).
+  """
+  now    = time.time()
+  due    = queue.pop_due(now)
+  wakeup = next_wakeup(queue,now)
+  if wakeup is not None:
+    with rtc:
+      rtc.set_alarm_time(datetime.fromtimestamp(wakeup))
+      if enable:
+        rtc.set_alarm(1)
+  return (due,wakeup)
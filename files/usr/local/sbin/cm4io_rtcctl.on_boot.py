@@ -2,13 +2,19 @@
 # --------------------------------------------------------------------------
 # Helper-Script for boot-processing.
 #
+# Usage: cm4io_rtcctl.on_boot.py [--trace file]
+#
+# With --trace, all bus-transactions are recorded in the given file (see
+# pcf85063a_trace.py). With the environment variable RTCCTL_SIM, the
+# simulated RTC is used and the system time is not changed.
+#
 # Author: Bernhard Bablok
 # License: GPL3
 #
 # Website: https://github.com/bablokb/cm4io_rtcctl
 # --------------------------------------------------------------------------
 
-import time, subprocess, datetime
+import os, sys
 
 import pcf85063a
 
@@ -16,7 +22,10 @@ import pcf85063a
 
 utc=True                    # all times in the RTC are stored as utc
                             # with automatic conversion while reading
+I2C_PORT = 10               # i2c-bus of the RTC
+I2C_ADDR = 0x51             # address of the RTC
 MAX_WAIT = 30               # maximum wait time for time synchronization
+ALARM_FILE = "/var/lib/cm4io_rtcctl/alarms"   # queue of wakeup-alarms
 
 # --- check state of RTC   -------------------------------------------------
 
@@ -30,32 +39,88 @@ def _check_rtc(ts):
 
 # --- manual boot processing   ---------------------------------------------
 
-def handle_manual_boot():
+def handle_manual_boot(snap):
   """ handle manual boot """
 
-  # get rtc time and check if it is valid
-  ts = rtc.read_datetime()
-  if not _check_rtc(ts):
+  # check rtc time (without marker, e.g. set by an older version)
+  ts = snap.local_time()
+  if ts is None or not _check_rtc(ts):
     print("rtc time is not valid, updating from system time")
     # update rtc time from system time
     rtc.write_system_datetime_now()
   else:
     # update system time from rtc
-    print("updating system time from rtc")
-    subprocess.run(['date', '-s', f'{rtc.read_datetime()}'])
+    set_system_time(snap)
+
+# --- update system time   -------------------------------------------------
+
+def set_system_time(snap):
+  """ update system time from rtc """
+
+  correction = rtc.set_system_datetime(snap)
+  print(f"updating system time from rtc (correction: {correction:+.3f}s)")
+
+# --- create RTC-object   --------------------------------------------------
+
+def get_rtc(trace_file=None):
+  """
+  Create the RTC-object. If the environment variable RTCCTL_SIM is set,
+  a simulated device is used instead of the hardware and the system clock
+  is never set (see cm4io_rtcctl.py). With trace_file, all
+  bus-transactions are recorded.
+  """
+
+  sim = os.environ.get("RTCCTL_SIM")
+  if sim is None and not trace_file:
+    return pcf85063a.PCF85063A(I2C_PORT,utc,I2C_ADDR)
+
+  if sim is None:
+    import i2cdev
+    bus  = i2cdev.I2CDev(I2C_PORT)
+    lock = pcf85063a.BusLock(I2C_PORT)
+  else:
+    import pcf85063a_sim
+    pcf85063a_sim.stub_clock_settime()
+    bus  = pcf85063a_sim.SimBus(latency=float(sim or 0)/1000)
+    lock = None
+
+  if trace_file:
+    import pcf85063a_trace, atexit
+    bus = pcf85063a_trace.TraceBus(bus,trace_file)
+    atexit.register(bus.close)
+  return pcf85063a.PCF85063A(I2C_PORT,utc,I2C_ADDR,bus=bus,lock=lock)
 
 # --- main program   -------------------------------------------------------
 
 if __name__ == "__main__":
-  rtc = pcf85063a.PCF85063A(10,utc)               # use i2c-10
-  (enabled,fired) = rtc.get_alarm_state()
-  print(f"rtc alarm state: {enabled=}, {fired=}")
-  if not fired:
-    handle_manual_boot()
-  else:
-    # assume valid rtc, update system time from rtc
-    subprocess.run(['date', '-s', f'{rtc.read_datetime()}'])
-    
-  # turn off alarm
-  rtc.clear_alarm()
-  rtc.set_alarm(0)
+  trace_file = None
+  if len(sys.argv) > 2 and sys.argv[1] == "--trace":
+    trace_file = sys.argv[2]
+  rtc = get_rtc(trace_file)
+
+  # all registers are read once (the snapshot fills the register-cache
+  # of the batch), all writes are flushed at the end of the batch
+  with rtc:
+    snap = rtc.snapshot()
+    print(f"rtc alarm state: enabled={snap.aie}, fired={snap.af}")
+    if snap.time_valid():
+      # time was written by a synchronized host: trust it
+      set_system_time(snap)
+    elif not snap.af:
+      handle_manual_boot(snap)
+    else:
+      # assume valid rtc, update system time from rtc
+      set_system_time(snap)
+
+    # turn off alarm, clear timer-flag (a running timer keeps running)
+    rtc.clear_alarm()
+    rtc.set_alarm(0)
+    rtc.clear_timer()
+
+    # drop due wakeup-alarms and program the next one (enabled at shutdown)
+    if os.path.exists(ALARM_FILE):
+      import alarm_queue
+      queue = alarm_queue.AlarmQueue(ALARM_FILE)
+      (due,wakeup) = alarm_queue.program(rtc,queue,enable=False)
+      queue.save()
+      print(f"wakeup-alarms: {len(due)} due, next wakeup: {wakeup}")
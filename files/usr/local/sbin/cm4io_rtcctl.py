@@ -14,6 +14,24 @@
 #  on    - turn alarm on
 #  off   - turn alarm on
 #  clear - clear alarm-flag
+#  daemon - serve commands over a unix-socket
+#  sync  - keep the RTC synchronized to the system time
+#  refclock - publish samples of the RTC for ntpd/chronyd (SHM refclock)
+#  calibrate - measure drift and program the offset register
+#  alarms - manage the queue of wakeup-alarms
+#  timer - program the countdown timer for periodic wakeups
+#  batch - execute commands from a file or stdin
+#  stats - export statistics (prometheus textfile or json)
+#
+# With the options --all, --bus and --addr in front of the command, the
+# commands show, dump, set (not set sys) and sync are executed for all
+# discovered RTCs.
+#
+# With the option --trace file in front of the command, all bus-transactions
+# are recorded in the given file (see pcf85063a_trace.py).
+#
+# If the daemon is running, commands are forwarded to the daemon. Otherwise
+# the script accesses the RTC directly.
 #
 # Author: Bernhard Bablok
 # License: GPL3
@@ -22,14 +40,72 @@
 #
 # --------------------------------------------------------------------------
 
-import os, sys, re, datetime
-
-import pcf85063a
+# note: all other modules are imported on demand (this keeps the startup
+# time of help and of commands forwarded to the daemon small)
+import os, sys, time
 
 # --- settings   -----------------------------------------------------------
 
 utc=True                    # all times in the RTC are stored as utc
                             # with automatic conversion while reading
+i2c_port=10                 # use i2c-10
+i2c_addr=0x51               # address of the RTC
+i2c_backend="i2cdev"        # i2cdev (no dependencies) or smbus
+lock_timeout=5.0            # max. wait time for the lock of the bus
+socket_path="/run/cm4io_rtcctl.sock"       # socket of the daemon
+sync_threshold=0.05         # max. offset of RTC to system time (seconds)
+sync_interval=(60,3600)     # min/max interval of sync-checks (seconds)
+sync_wait=(10,600)          # min/max interval while the system time is not
+                            # synchronized (seconds)
+alarm_file="/var/lib/cm4io_rtcctl/alarms" # queue of wakeup-alarms
+stats_file=None             # textfile for the node_exporter, e.g.
+                            # /var/lib/node_exporter/cm4io_rtcctl.prom
+                            # (enables instrumentation of daemon and sync)
+trace_file=None             # record all bus-transactions (option --trace)
+refclock_unit=2             # unit of the SHM refclock (chrony/ntpd)
+
+# commands supported by the daemon
+DAEMON_COMMANDS = ["init", "show", "dump", "set", "alarm", "alarms", "timer",
+                   "stats"]
+
+# commands supported by batch
+BATCH_COMMANDS = DAEMON_COMMANDS + ["calibrate"]
+
+# commands supported in fleet-mode (--all, --bus, --addr)
+FLEET_COMMANDS = ["show", "dump", "set", "sync"]
+
+# --- create RTC-object   --------------------------------------------------
+
+def get_rtc():
+  """
+  Create the RTC-object. If the environment variable RTCCTL_SIM is set,
+  a simulated device is used instead of the hardware (and the system
+  clock is never set). The value of the variable is the latency of every
+  bus-transaction in ms (default: 0).
+  With trace_file, all bus-transactions are recorded.
+  """
+  import pcf85063a
+
+  sim = os.environ.get("RTCCTL_SIM")
+  if sim is None:
+    lock = pcf85063a.BusLock(i2c_port,lock_timeout)
+    if i2c_backend == "smbus":
+      import smbus
+      bus = smbus.SMBus(i2c_port)
+    else:
+      import i2cdev
+      bus = i2cdev.I2CDev(i2c_port)
+  else:
+    import pcf85063a_sim
+    pcf85063a_sim.stub_clock_settime()
+    lock = None
+    bus  = pcf85063a_sim.SimBus(latency=float(sim or 0)/1000)
+
+  if trace_file:
+    import pcf85063a_trace, atexit
+    bus = pcf85063a_trace.TraceBus(bus,trace_file)
+    atexit.register(bus.close)
+  return pcf85063a.PCF85063A(i2c_port,utc,i2c_addr,bus=bus,lock=lock)
 
 # --- help   ---------------------------------------------------------------
 
@@ -41,8 +117,11 @@ def help():
 Available commands (date and time are synonyms):
      help                                - dump list of available commands
      init                                - initialize RTC
-     show  [date|time|alarm|sys]         - display given type or all
-     dump  [control|date|time|alarm]     - display registers (hex/binary format)
+     show  [--json] [date|time|alarm|timer|sys|offset|lock]
+                                         - display given type or all
+     show  --watch [--json]              - display time and offset every tick
+     dump  [--json] [control|offset|date|time|alarm|timer]
+                                         - display registers
      set   date|time|alarm|sys           - set rtc-date, alarm, sys-date
                                            Format: dd.mm.YYYY [HH:MM[:SS]] or
                                                    mm/dd/YYYY [HH:MM[:SS]]
@@ -50,6 +129,32 @@ Available commands (date and time are synonyms):
      alarm on                            - turn alarm on
      alarm off                           - turn alarm off
      alarm clear                         - clear alarm-flag
+     daemon [socket]                     - serve commands over a unix-socket
+     sync  [once]                        - keep rtc synchronized to sys-date
+     refclock [unit]                     - publish rtc-samples for chrony/ntpd
+     refclock show [unit]                - display sample of SHM refclock
+     calibrate [minutes]                 - measure drift (default: 60 minutes)
+                                           and program offset-register
+     alarms add name date [time]         - add wakeup-alarm to queue
+     alarms remove name                  - remove wakeup-alarm(s) from queue
+     alarms list                         - list queue of wakeup-alarms
+     alarms program                      - program and enable next wakeup
+     timer set seconds [pulse]           - start periodic countdown timer
+     timer stop                          - stop countdown timer
+     timer clear                         - clear timer-flag
+     batch [file]                        - execute commands from file/stdin
+     stats [--json] [file]               - export statistics (prometheus-
+                                           textfile or json)
+
+Fleet-mode (execute show, dump, set date|time|alarm, sync for all
+discovered RTCs):
+     --all                               - probe all i2c-buses
+     --bus n[,m...]                      - probe the given i2c-buses
+     --addr a[,b...]                     - probe the given addresses
+                                           (default: 0x51)
+
+Options (in front of the command):
+     --trace file                        - record all bus-transactions
   """)
 
 # --- init   ---------------------------------------------------------------
@@ -59,10 +164,13 @@ def init(rtc,argv=[]):
   Initialize RTC (set rtc-datetime to system-datetime, set alarm-times
   and clear/disable alarms)
   """
-  rtc.write_system_datetime_now()
-  rtc.set_alarm_time(datetime.datetime.now())
-  rtc.clear_alarm()
-  rtc.set_alarm(0)
+  import datetime
+
+  with rtc:
+    rtc.write_system_datetime_now(_ntp_synchronized())
+    rtc.set_alarm_time(datetime.datetime.now())
+    rtc.clear_alarm()
+    rtc.set_alarm(0)
 
 # --- show   ---------------------------------------------------------------
 
@@ -70,9 +178,16 @@ def show(rtc,argv=[]):
   """
   Display date, time, alarm or all (date and time are synonyms)
   
-  Arg: date|time|alarm|sys|all (default: all)
+  Arg: [--json] date|time|alarm|timer|sys|offset|lock|all (default: all)
+       --watch [--json] (display time and offset on every tick of the RTC)
   """
-  if len(argv) == 0:
+  import datetime
+
+  if "--watch" in argv:
+    _watch(rtc,"--json" in argv)
+  elif "--json" in argv:
+    _show_json(rtc,[arg for arg in argv if arg != "--json"])
+  elif len(argv) == 0:
     show(rtc,["date"])
     show(rtc,["sys"])
     show(rtc,["alarm"])
@@ -83,40 +198,130 @@ def show(rtc,argv=[]):
     (enabled,fired) = rtc.get_alarm_state()
     print("        (enabled: %s)" % enabled)
     print("        (fired:   %s)" % fired)
+  elif argv[0] == "timer":
+    print("timer:  %gs" % rtc.get_timer_period())
+    (enabled,fired) = rtc.get_timer_state()
+    print("        (enabled: %s)" % enabled)
+    print("        (fired:   %s)" % fired)
   elif argv[0] == "sys":
     print("sys:    %s" % datetime.datetime.now())
+  elif argv[0] == "offset":
+    print("offset: %+.3fs" % rtc.measure_offset())
+  elif argv[0] == "lock":
+    stats = rtc.lock_stats()
+    if stats:
+      print("lock:   %d acquired, %d contended, wait %.1fms total, %.1fms max" %
+            (stats[0],stats[1],1000*stats[2],1000*stats[3]))
+    else:
+      print("lock:   not used")
   else:
     print("invalid argument")
 
+def _isoformat(dtime):
+  """ datetime as ISO 8601 string or None """
+  return dtime.isoformat() if dtime else None
+
+def _show_json(rtc,argv):
+  """
+  Display date, time, alarm or all as json (a single object). All values
+  from the RTC are taken from one snapshot of the registers.
+  """
+  import json, datetime
+
+  what  = argv[0] if len(argv) else "all"
+  snap  = rtc.snapshot()
+  state = {}
+  if what in ["all", "date", "time"]:
+    state["date"] = _isoformat(snap.local_time())
+  if what in ["all", "sys"]:
+    state["sys"] = datetime.datetime.now().isoformat()
+  if what in ["all", "alarm"]:
+    state["alarm"]         = _isoformat(snap.alarm_time())
+    state["alarm_enabled"] = snap.aie
+    state["alarm_fired"]   = snap.af
+  if what == "timer":
+    state["timer"]         = snap.timer_period()
+    state["timer_enabled"] = snap.timer_enabled
+    state["timer_fired"]   = snap.tf
+  if what == "offset":
+    state["offset"] = rtc.measure_offset()
+  if what == "lock":
+    stats = rtc.lock_stats()
+    state["lock"] = dict(zip(["count", "contended", "wait_total", "wait_max"],
+                             stats)) if stats else None
+  if state:
+    print(json.dumps(state))
+  else:
+    print("invalid argument")
+
+def _watch(rtc,as_json):
+  """
+  Display RTC-time, system time and offset on every tick of the RTC
+  until interrupted.
+  """
+  import json, datetime
+
+  try:
+    for t_edge,rtc_time,error in rtc.watch():
+      rtc_dtime = datetime.datetime.fromtimestamp(rtc_time)
+      sys_dtime = datetime.datetime.fromtimestamp(t_edge)
+      if as_json:
+        print(json.dumps({"date":   rtc_dtime.isoformat(),
+                          "sys":    sys_dtime.isoformat(),
+                          "offset": round(rtc_time-t_edge,6),
+                          "error":  round(error,6)}),flush=True)
+      else:
+        print("date: %s  sys: %s  offset: %+.3fs" %
+              (rtc_dtime,sys_dtime.isoformat(" ","milliseconds"),
+               rtc_time-t_edge),flush=True)
+  except KeyboardInterrupt:
+    pass
+
 # --- dump   ---------------------------------------------------------------
 
 def dump(rtc,argv=[]):
   """
-  Display registers (hex/binary format)
+  Display registers (hex/binary format). All registers are read with a
+  single transaction. With --json, the complete decoded register map is
+  displayed.
 
-  Arg: control|date|time|alarm|all (default: all)
+  Arg: [--json] control|offset|date|time|alarm|timer|all (default: all)
   """
-  if len(argv) == 0:
-    dump(rtc,["control"])
-    dump(rtc,["date"])
-    dump(rtc,["alarm"])
-  elif argv[0] == "control":
-    print("control:        %s" % rtc.dump_register(rtc._CONTROL2_REGISTER))
-  elif argv[0] == "date" or argv[0] == "time":
-    print("date  (sec):   %s" % rtc.dump_register(rtc._SECONDS_REGISTER))
-    print("date  (min):   %s" % rtc.dump_register(rtc._MINUTES_REGISTER))
-    print("date  (hour):  %s" % rtc.dump_register(rtc._HOURS_REGISTER))
-    print("date  (weekd): %s" % rtc.dump_register(rtc._DAY_OF_WEEK_REGISTER))
-    print("date  (day):   %s" % rtc.dump_register(rtc._DAY_OF_MONTH_REGISTER))
-    print("date  (month): %s" % rtc.dump_register(rtc._MONTH_REGISTER))
-    print("date  (year):  %s" % rtc.dump_register(rtc._YEAR_REGISTER))
-  elif argv[0] == "alarm":
-    print("alarm (sec):   %s" % rtc.dump_register(rtc._ALARM_SEC_REGISTER))
-    print("alarm (min):   %s" % rtc.dump_register(rtc._ALARM_MIN_REGISTER))
-    print("alarm (hour):  %s" % rtc.dump_register(rtc._ALARM_HOUR_REGISTER))
-    print("alarm (date):  %s" % rtc.dump_register(rtc._ALARM_DATE_REGISTER))
-  else:
+  snap = rtc.snapshot()
+  if "--json" in argv:
+    import json
+    print(json.dumps(snap.to_dict()))
+    return
+
+  regs = snap.raw
+  if len(argv) == 0 or argv[0] == "all":
+    argv = ["control", "offset", "date", "alarm"]
+  elif argv[0] == "time":
+    argv = ["date"]
+  elif argv[0] not in ["control", "offset", "date", "alarm", "timer"]:
     print("invalid argument")
+    return
+
+  if "control" in argv:
+    print("control:        %s" % rtc.dump_value(regs[rtc._CONTROL2_REGISTER]))
+  if "offset" in argv:
+    print("offset:         %s" % rtc.dump_value(regs[rtc._OFFSET_REGISTER]))
+  if "date" in argv:
+    print("date  (sec):   %s" % rtc.dump_value(regs[rtc._SECONDS_REGISTER]))
+    print("date  (min):   %s" % rtc.dump_value(regs[rtc._MINUTES_REGISTER]))
+    print("date  (hour):  %s" % rtc.dump_value(regs[rtc._HOURS_REGISTER]))
+    print("date  (weekd): %s" % rtc.dump_value(regs[rtc._DAY_OF_WEEK_REGISTER]))
+    print("date  (day):   %s" % rtc.dump_value(regs[rtc._DAY_OF_MONTH_REGISTER]))
+    print("date  (month): %s" % rtc.dump_value(regs[rtc._MONTH_REGISTER]))
+    print("date  (year):  %s" % rtc.dump_value(regs[rtc._YEAR_REGISTER]))
+  if "alarm" in argv:
+    print("alarm (sec):   %s" % rtc.dump_value(regs[rtc._ALARM_SEC_REGISTER]))
+    print("alarm (min):   %s" % rtc.dump_value(regs[rtc._ALARM_MIN_REGISTER]))
+    print("alarm (hour):  %s" % rtc.dump_value(regs[rtc._ALARM_HOUR_REGISTER]))
+    print("alarm (date):  %s" % rtc.dump_value(regs[rtc._ALARM_DATE_REGISTER]))
+  if "timer" in argv:
+    print("timer (value): %s" % rtc.dump_value(regs[rtc._TIMER_VALUE_REGISTER]))
+    print("timer (mode):  %s" % rtc.dump_value(regs[rtc._TIMER_MODE_REGISTER]))
 
 # --- set   ----------------------------------------------------------------
 
@@ -126,45 +331,65 @@ def set(rtc,argv):
   
   Arg: date|time|alarm
   """
+  import datetime
+
   if argv[0] == "date" or argv[0] == "time":
     if len(argv) == 1:
-      rtc.write_system_datetime_now()
+      rtc.write_system_datetime_precise(valid=_ntp_synchronized())
       return
   elif argv[0] == "sys":
-    dtime = rtc.read_datetime()
-    os.system('date -s "%s"' % dtime)
+    correction = rtc.set_system_datetime()
+    print("sys:    %s (correction: %+.3fs)" % (datetime.datetime.now(),correction))
     return
 
-  dateString = argv[1] + (" " + argv[2] if len(argv) > 2 else "")
-  if '/' in dateString:
-    format = "%m/%d/%Y %H:%M:%S"
+  dtime = _parse_datetime(argv[1:])
+  if dtime is None:
+    return
+  if argv[0] == "alarm":
+    rtc.set_alarm_time(dtime)
+  elif argv[0] == "date" or argv[0] == "time":
+    rtc.write_datetime(dtime)
   else:
-    format = "%d.%m.%Y %H:%M:%S"
+    print("invalid argument")
+
+def _parse_datetime(argv):
+  """
+  Parse date and optional time. Returns a datetime or None on errors.
+  (strptime and re are not used, since importing them takes longer than
+  the rest of most commands)
+  """
+  import datetime
+
+  if not len(argv):
+    print("missing datetime!")
+    return None
+  dateString = argv[0] + (" " + argv[1] if len(argv) > 1 else "")
 
   # add default hour:minutes:secs if not provided
   if ':'  not in dateString:
     dateString = dateString + " 00:00:00"
 
   # parse string and check if we have six items
-  dateParts= re.split(r'\.|/|:| ',dateString)
+  dateParts = dateString.replace('.',' ').replace('/',' ').replace(':',' ')
+  dateParts = dateParts.split(' ')
   count = len(dateParts)
   if count < 5 or count > 6:
     print("illegal datetime format!")
     print("Must be mm/dd/yy[yy] [HH:MM[:SS]] or")
     print("        dd.mm.yy[yy] [HH:MM[:SS]]")
-    return
+    return None
   elif count == 5:
-    dateString = dateString + ":00"
+    dateParts.append("00")
 
+  values = [int(part) for part in dateParts]
+  if '/' in dateString:
+    (month,day,year) = values[:3]
+  else:
+    (day,month,year) = values[:3]
   if len(dateParts[2]) == 2:
-    format = format.replace('Y','y')
+    year += 2000 if year < 69 else 1900          # same as strptime (%y)
 
-  if argv[0] == "alarm":
-    rtc.set_alarm_time(datetime.datetime.strptime(dateString,format))
-  elif argv[0] == "date" or argv[0] == "time":
-    rtc.write_datetime(datetime.datetime.strptime(dateString,format))
-  else:
-    print("invalid argument")
+  return datetime.datetime(year,month,day,*values[3:])
 
 # --- alarm on/off/clear   -------------------------------------------------
 
@@ -181,19 +406,576 @@ def alarm(rtc,argv):
   else:
     print("invalid argument")
 
+# --- sync   ---------------------------------------------------------------
+
+def _ntp_synchronized():
+  """
+  Check if the system clock is synchronized (state of the kernel clock)
+  """
+  import ctypes
+  libc = ctypes.CDLL(None,use_errno=True)
+  buf = ctypes.create_string_buffer(512)     # struct timex, modes=0: read
+  return libc.adjtimex(buf) not in (-1,5)    # 5: TIME_ERROR
+
+def _sync_check(rtc,interval):
+  """
+  Measure the offset, update the RTC if necessary and return the next
+  interval.
+  """
+  offset = rtc.measure_offset()
+  if rtc.get_stats():
+    rtc.get_stats().set_gauge("offset_seconds",offset)
+  if abs(offset) > sync_threshold:
+    rtc.write_system_datetime_precise(valid=True)
+    interval = sync_interval[0]
+    print("sync: offset %+.3fs, rtc updated, next check in %ds" %
+          (offset,interval),flush=True)
+  else:
+    if not rtc.get_time_valid():
+      rtc.set_time_valid()
+    interval = min(2*interval,sync_interval[1])
+    print("sync: offset %+.3fs, next check in %ds" % (offset,interval),
+          flush=True)
+  return interval
+
+def sync(rtc,argv=[]):
+  """
+  Keep the RTC synchronized to the system time. As soon as the system
+  clock is synchronized, the offset of the RTC is measured periodically
+  and the RTC is only written if the offset exceeds sync_threshold.
+  The interval between checks doubles while the RTC is stable and is
+  reset after every correction. While the system clock is not
+  synchronized, the interval between polls doubles (see sync_wait) and
+  only changes of the state are logged. A final check is done on SIGTERM.
+
+  Arg: once (check once and exit)
+  """
+  import signal
+
+  once = len(argv) > 0 and argv[0] == "once"
+  if not once:
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    if stats_file:
+      _enable_stats(rtc)
+  interval = sync_interval[0]
+  wait     = sync_wait[0]
+  synced   = None                         # last state (None: unknown)
+  try:
+    while True:
+      if not _ntp_synchronized():
+        if synced is not False:
+          print("sync: system time is not synchronized",flush=True)
+          synced = False
+        if once:
+          return
+        time.sleep(wait)
+        wait = min(2*wait,sync_wait[1])
+        continue
+      if synced is False:
+        print("sync: system time is synchronized",flush=True)
+      synced = True
+      wait   = sync_wait[0]
+      interval = _sync_check(rtc,interval)
+      if once:
+        return
+      _write_stats(rtc)
+      time.sleep(interval)
+  except (SystemExit,KeyboardInterrupt):
+    if _ntp_synchronized():
+      _sync_check(rtc,interval)
+
+# --- refclock   -----------------------------------------------------------
+
+def refclock(rtc,argv=[]):
+  """
+  Publish a sample of the RTC on every tick in the shared memory segment
+  of the SHM refclock driver of ntpd/chronyd (mode 1). The sample is the
+  time of the RTC and the system time of the detected edge of the seconds
+  register. Samples are only published while the oscillator of the RTC
+  did not stop.
+
+  Args: [show] [unit] (default: refclock_unit)
+  """
+  import signal, datetime, ntpshm
+
+  show = len(argv) > 0 and argv[0] == "show"
+  argv = argv[1:] if show else argv
+  unit = int(argv[0]) if len(argv) else refclock_unit
+
+  if show:
+    try:
+      segment = ntpshm.SHMSegment(unit,create=False)
+    except OSError as ex:
+      print("refclock: unit %d: %s" % (unit,ex.strerror))
+      return
+    sample = segment.read()
+    segment.close()
+    if sample is None:
+      print("refclock: no valid sample in unit %d" % unit)
+    else:
+      print("rtc:    %s" % datetime.datetime.fromtimestamp(sample[0]))
+      print("sys:    %s" % datetime.datetime.fromtimestamp(sample[1]))
+      print("offset: %+.6fs (precision 2^%d s)" %
+            (sample[0]-sample[1],sample[2]))
+    return
+
+  signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+  segment = ntpshm.SHMSegment(unit)
+  count   = 0
+  try:
+    for t_edge,rtc_time,error in rtc.watch():
+      # check the state of the RTC once a minute, log once an hour
+      if count % 60 == 0:
+        snap = rtc.snapshot()
+        if snap.oscillator_stop or snap.time is None:
+          print("refclock: rtc time is not valid, stopped publishing",
+                flush=True)
+          return
+        if count == 0:
+          if not snap.time_valid():
+            print("refclock: warning: rtc time was not set from a "
+                  "synchronized host",flush=True)
+          print("refclock: publishing samples in unit %d" % unit,flush=True)
+        elif count % 3600 == 0:
+          print("refclock: offset %+.3fs (%d samples)" %
+                (rtc_time-t_edge,count),flush=True)
+      segment.write(rtc_time,t_edge,ntpshm.precision(error))
+      count += 1
+  except (SystemExit,KeyboardInterrupt):
+    pass
+  finally:
+    segment.close()
+
+# --- countdown timer   ----------------------------------------------------
+
+def timer(rtc,argv):
+  """
+  Program the countdown timer
+
+  Arg: set seconds [pulse]|stop|clear
+  """
+  if not len(argv):
+    print("invalid argument")
+  elif argv[0] == "set" and len(argv) > 1:
+    rtc.set_timer_period(float(argv[1]),
+                         pulse=len(argv) > 2 and argv[2] == "pulse")
+  elif argv[0] == "stop":
+    rtc.stop_timer()
+  elif argv[0] == "clear":
+    rtc.clear_timer()
+  else:
+    print("invalid argument")
+
+# --- queue of wakeup-alarms   ---------------------------------------------
+
+def alarms(rtc,argv):
+  """
+  Manage the queue of wakeup-alarms
+
+  Arg: add name date [time]|remove name|list|program
+  """
+  import datetime, alarm_queue
+
+  queue = alarm_queue.AlarmQueue(alarm_file)
+  if not len(argv):
+    print("invalid argument")
+  elif argv[0] == "add" and len(argv) > 2:
+    dtime = _parse_datetime(argv[2:])
+    if dtime:
+      queue.add(dtime.timestamp(),argv[1])
+      queue.save()
+  elif argv[0] == "remove" and len(argv) > 1:
+    print("removed %d alarm(s)" % queue.remove(argv[1]))
+    queue.save()
+  elif argv[0] == "list":
+    for when,name in queue:
+      print("%s  %s" % (datetime.datetime.fromtimestamp(when),name))
+  elif argv[0] == "program":
+    (due,wakeup) = alarm_queue.program(rtc,queue)
+    queue.save()
+    for when,name in due:
+      print("due:    %s  %s" % (datetime.datetime.fromtimestamp(when),name))
+    if wakeup is not None:
+      print("wakeup: %s" % datetime.datetime.fromtimestamp(wakeup))
+  else:
+    print("invalid argument")
+
+# --- calibrate   ----------------------------------------------------------
+
+def calibrate(rtc,argv=[]):
+  """
+  Measure the drift of the RTC against the (synchronized) system time and
+  program the offset-register.
+
+  Arg: duration of the measurement in minutes (default: 60)
+  """
+  duration = 60*float(argv[0]) if len(argv) else 3600
+  if not _ntp_synchronized():
+    print("warning: system time is not synchronized")
+
+  samples = []
+  end = time.time() + duration
+  while True:
+    samples.append(rtc.sample())
+    print("calibrate: offset %+.4fs" % (samples[-1][1]-samples[-1][0]),
+          flush=True)
+    if time.time() >= end:
+      break
+    time.sleep(max(min(60,end-time.time()),0))
+
+  (drift,value,coarse,residual) = rtc.calibrate(samples)
+  print("drift:  %+.2f ppm" % drift)
+  print("offset: %d (%s mode), residual drift %+.2f ppm" %
+        (value,"coarse" if coarse else "normal",residual))
+
+# --- statistics   ---------------------------------------------------------
+
+def _enable_stats(rtc):
+  """ turn on instrumentation of the RTC (if necessary) """
+  if not rtc.get_stats():
+    import pcf85063a_stats
+    rtc.set_stats(pcf85063a_stats.Stats({"bus": i2c_port,
+                                         "addr": "0x%02x" % i2c_addr}))
+  return rtc.get_stats()
+
+def _write_stats(rtc):
+  """ update stats_file (if instrumentation is on) """
+  if not stats_file or not rtc.get_stats():
+    return
+  import pcf85063a_stats
+  try:
+    pcf85063a_stats.collect(rtc,rtc.get_stats(),offset=False)
+    rtc.get_stats().write_textfile(stats_file)
+  except OSError as ex:
+    sys.stderr.write("stats: %s\n" % ex)
+
+def stats(rtc,argv=[]):
+  """
+  Export the statistics (transactions, latencies, offset, alarm- and
+  timer-state) in the textfile-format of the prometheus node_exporter or
+  as json. Instrumentation is turned on if necessary, so outside of the
+  daemon only the transactions of this command are accounted.
+
+  Args: --json, file (default: stdout)
+  """
+  import pcf85063a_stats
+
+  as_json = "--json" in argv
+  argv    = [arg for arg in argv if arg != "--json"]
+  rtc_stats = _enable_stats(rtc)
+  pcf85063a_stats.collect(rtc,rtc_stats)
+
+  if as_json:
+    import json
+    text = json.dumps(rtc_stats.to_dict(),indent=2) + "\n"
+  else:
+    text = rtc_stats.to_prometheus()
+  if len(argv):
+    tmp = argv[0] + ".tmp"
+    with open(tmp,"w") as f:
+      f.write(text)
+    os.replace(tmp,argv[0])
+  else:
+    sys.stdout.write(text)
+
+# --- daemon   -------------------------------------------------------------
+
+def daemon(rtc,argv=[]):
+  """
+  Serve commands over a unix-socket. The daemon keeps the RTC-object and
+  the bus open, so clients don't pay for interpreter-start and imports.
+
+  Protocol: the client sends the arguments separated by NUL and terminated
+  by a newline. The daemon replies with a status byte (0: ok, 1: error)
+  followed by the output of the command and closes the connection.
+
+  Arg: socket (default: /run/cm4io_rtcctl.sock)
+  """
+  import socketserver, io, contextlib, signal
+
+  path = argv[0] if len(argv) else socket_path
+  funcs = globals()
+  if stats_file:
+    _enable_stats(rtc)
+
+  class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+      args = self.rfile.readline().rstrip(b"\n").decode().split("\0")
+      out = io.StringIO()
+      status = b"0"
+      with contextlib.redirect_stdout(out):
+        try:
+          if args[0] in DAEMON_COMMANDS:
+            funcs[args[0]](rtc,args[1:])
+          else:
+            print("command %s not found!" % args[0])
+            status = b"1"
+        except Exception as ex:
+          print("error: %s" % ex)
+          status = b"1"
+      self.wfile.write(status + out.getvalue().encode())
+      _write_stats(rtc)
+
+  if os.path.exists(path):
+    os.unlink(path)
+  server = socketserver.UnixStreamServer(path,Handler)
+  os.chmod(path,0o660)
+  signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+  try:
+    server.serve_forever()
+  except (SystemExit,KeyboardInterrupt):
+    pass
+  finally:
+    server.server_close()
+    os.unlink(path)
+
+def call_daemon(argv):
+  """
+  Forward a command to the daemon and print the result. Returns the
+  status of the command or None if the daemon is not running (or does
+  not answer in time).
+  """
+  if not os.path.exists(socket_path):
+    return None
+
+  import socket
+  try:
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as sock:
+      sock.settimeout(10)
+      sock.connect(socket_path)
+      sock.sendall("\0".join(argv).encode() + b"\n")
+      response = b""
+      while True:
+        data = sock.recv(4096)
+        if not data:
+          break
+        response += data
+  except OSError:                             # includes timeouts
+    return None
+  sys.stdout.write(response[1:].decode())
+  return int(response[:1] or b"1")
+
+# --- batch   --------------------------------------------------------------
+
+def _write_only(args):
+  """
+  Check if the command only writes registers (and can be combined with
+  other commands to a batch of register-writes)
+  """
+  return (args[0] in ["init", "alarm", "timer"] or
+          args[:2] == ["set", "alarm"] or args[:2] == ["alarms", "program"])
+
+def batch(rtc,argv=[]):
+  """
+  Execute commands from a file or stdin (one command per line, '#' starts
+  a comment) with a single RTC-object. Consecutive commands that only
+  write registers are combined to a single batch of register-writes.
+  Prints the execution time of every command at the end.
+
+  Arg: file (default: stdin, also '-')
+  """
+  import shlex, contextlib
+
+  if len(argv) and argv[0] != "-":
+    with open(argv[0]) as f:
+      lines = f.readlines()
+  else:
+    lines = sys.stdin.readlines()
+
+  # parse and check all commands before touching the RTC
+  commands = []
+  for nr,line in enumerate(lines,1):
+    args = shlex.split(line,comments=True)
+    if not args:
+      continue
+    if args[0] not in BATCH_COMMANDS:
+      print("line %d: command %s not supported in batch!" % (nr,args[0]))
+      sys.exit(1)
+    commands.append((nr,args))
+
+  funcs   = globals()
+  timing  = []
+  pending = contextlib.ExitStack()
+  start   = time.perf_counter()
+  with pending:
+    for nr,args in commands:
+      if not _write_only(args):
+        pending.close()                  # flush pending writes
+      elif not timing or not _write_only(timing[-1][0]):
+        pending.enter_context(rtc)
+      t_cmd = time.perf_counter()
+      try:
+        funcs[args[0]](rtc,args[1:])
+      except Exception as ex:
+        print("line %d: error: %s" % (nr,ex))
+        pending.close()                  # keep writes of previous commands
+        sys.exit(1)
+      timing.append((args,time.perf_counter()-t_cmd))
+  total = time.perf_counter() - start
+
+  for args,duration in timing:
+    print("%9.2fms  %s" % (1000*duration," ".join(args)))
+  print("%9.2fms  total (%d commands)" % (1000*total,len(timing)))
+
+# --- fleet-mode   ---------------------------------------------------------
+
+class _ThreadOutput(object):
+  """
+  Replacement of sys.stdout collecting the output of every thread
+  separately (between begin() and end()).
+  """
+
+  def __init__(self,stream):
+    import threading
+    self.stream = stream
+    self._local = threading.local()
+
+  def begin(self):
+    self._local.buffer = []
+
+  def end(self):
+    text = "".join(self._local.buffer)
+    self._local.buffer = None
+    return text
+
+  def write(self,text):
+    buffer = getattr(self._local,"buffer",None)
+    if buffer is None:
+      return self.stream.write(text)
+    buffer.append(text)
+    return len(text)
+
+  def flush(self):
+    if getattr(self._local,"buffer",None) is None:
+      self.stream.flush()
+
+def _fleet_options(argv):
+  """
+  Parse the options of the fleet-mode in front of the command. Returns a
+  tuple (argv,ports,addrs) with the remaining arguments. ports is None
+  without options and an empty list for all buses.
+  """
+  ports, addrs = None, []
+  while len(argv) and argv[0].startswith("--"):
+    if argv[0] == "--all":
+      ports = ports or []
+      argv  = argv[1:]
+    elif argv[0] in ["--bus", "--addr"] and len(argv) > 1:
+      values = [int(value,0) for value in argv[1].split(",")]
+      if argv[0] == "--bus":
+        ports = (ports or []) + values
+      else:
+        ports = ports or []
+        addrs += values
+      argv = argv[2:]
+    else:
+      break
+  return (argv,ports,addrs)
+
+def run_fleet(command,argv,ports,addrs):
+  """
+  Execute a command for all discovered RTCs (one thread per bus) and
+  print the output of every RTC. show/dump with --json print a single
+  json-list with one object per RTC. sync only checks once.
+  """
+  import fleet
+
+  sim = os.environ.get("RTCCTL_SIM")
+  if sim is None:
+    bus_factory, timeout = None, lock_timeout
+    ports = ports or None                         # default: all buses
+  else:
+    import pcf85063a_sim
+    pcf85063a_sim.stub_clock_settime()
+    latency = float(sim or 0)/1000
+    bus_factory = lambda port: pcf85063a_sim.SimBus(latency=latency)
+    timeout = None
+    ports = ports or [i2c_port]
+  if command == "sync":
+    argv = ["once"]
+  elif command == "set" and (not len(argv) or
+                             argv[0] not in ["date", "time", "alarm"]):
+    # set sys would set the system clock once per RTC
+    print("only set date|time|alarm is supported in fleet-mode!")
+    sys.exit(1)
+  elif "--watch" in argv:
+    print("--watch is not supported in fleet-mode!")
+    sys.exit(1)
+
+  devices = fleet.discover(ports,addrs or [i2c_addr],bus_factory)
+  if not devices:
+    print("no RTC found!")
+    sys.exit(1)
+  group = fleet.Fleet(devices,utc,bus_factory,timeout)
+
+  func   = globals()[command]
+  output = _ThreadOutput(sys.stdout)
+  def job(rtc):
+    output.begin()
+    try:
+      func(rtc,argv)
+    finally:
+      text = output.end()
+    return text
+
+  sys.stdout = output
+  start = time.monotonic()
+  try:
+    results = group.run(job)
+  finally:
+    sys.stdout = output.stream
+    group.close()
+  duration = time.monotonic() - start
+  errors = sum(1 for result in results if result[3])
+
+  if "--json" in argv and command in ["show", "dump"]:
+    import json
+    print(json.dumps([{"bus":   port,
+                       "addr":  addr,
+                       "state": json.loads(text) if text else None,
+                       "error": str(error) if error else None}
+                      for port,addr,text,error,_ in results]))
+  else:
+    for port,addr,text,error,elapsed in results:
+      print("--- i2c-%d 0x%02x (%.1fms) ---" % (port,addr,1000*elapsed))
+      if error:
+        print("error: %s" % error)
+      else:
+        sys.stdout.write(text)
+    print("--- %d RTC(s) on %d bus(es), %d error(s), %.1fms ---" %
+          (len(results),len({result[0] for result in results}),errors,
+           1000*duration))
+  if errors:
+    sys.exit(1)
+
 # --- main program   ------------------------------------------------------
 
 if __name__ == "__main__":
-  if len(sys.argv) == 1:
+  argv = sys.argv[1:]
+  if len(argv) > 1 and argv[0] == "--trace":
+    trace_file = argv[1]
+    argv = argv[2:]
+  (argv,ports,addrs) = _fleet_options(argv)
+  if len(argv) == 0:
     help()
   else:
     funcs = locals()
-    command = sys.argv[1]
+    command = argv[0]
     if command == 'help':
       help()
+    elif ports is not None:
+      if command in FLEET_COMMANDS:
+        run_fleet(command,argv[1:],ports,addrs)
+      else:
+        print("command %s not supported in fleet-mode!" % command)
+        sys.exit(1)
+    elif (command in DAEMON_COMMANDS and "RTCCTL_SIM" not in os.environ and
+          not trace_file and "--watch" not in argv and
+          (status := call_daemon(argv)) is not None):
+      sys.exit(status)                            # status of the daemon
     elif command in funcs:
-      rtc = pcf85063a.PCF85063A(10,utc)               # use i2c-10
-      funcs[command](rtc,sys.argv[2:])
+      rtc = get_rtc()
+      funcs[command](rtc,argv[1:])
     else:
       print("command %s not found!" % command)
       help()
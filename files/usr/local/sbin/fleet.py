@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Discovery of PCF85063A-RTCs on all i2c-buses and parallel access to many
+# devices.
+#
+# Transactions on one bus are serial anyway, so there is one worker-thread
+# per bus which talks to the devices of this bus one after another. Buses
+# behind an i2c-mux are separate /dev/i2c-N devices, the kernel serializes
+# the transactions on the parent bus.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, time
+
+import pcf85063a
+
+def list_ports():
+  """ return the numbers of all i2c-buses (/dev/i2c-N) """
+  ports = []
+  for name in os.listdir("/dev"):
+    if name.startswith("i2c-") and name[4:].isdigit():
+      ports.append(int(name[4:]))
+  return sorted(ports)
+
+def open_bus(port):
+  """ default bus-factory: open the bus with the i2c-dev backend """
+  import i2cdev
+  return i2cdev.I2CDev(port)
+
+def probe(bus,addr=pcf85063a.PCF85063A_ADDR):
+  """
+  Check if the device at the given address is a PCF85063A. The check reads
+  the register map plus one byte: the address-pointer of the PCF85063A
+  wraps from 0x11 to 0x00, unused bits read as zero and the time-registers
+  are valid BCD-values.
+  """
+  try:
+    regs = bus.read_i2c_block_data(addr,0x00,0x13)
+  except OSError:
+    return False
+  if len(regs) < 0x13 or regs[0x12] != regs[0x00]:
+    return False
+  if regs[0x00] & 0x58 or regs[0x11] & 0xE0:          # unused bits, SR
+    return False
+  for reg,mask,limit in ((0x04,0x7F,59),(0x05,0x7F,59),(0x06,0x3F,23),
+                         (0x07,0x3F,31),(0x09,0x1F,12),(0x0A,0xFF,99)):
+    value = regs[reg] & mask
+    if (value & 0x0F) > 9 or (value >> 4)*10 + (value & 0x0F) > limit:
+      return False
+  return regs[0x08] < 7                                # weekday
+
+def _run_parallel(jobs):
+  """
+  Execute a dict port->function with one thread per port and return a
+  dict port->result of the function
+  """
+  import concurrent.futures
+
+  if not jobs:
+    return {}
+  with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+    futures = {port: pool.submit(job) for port,job in jobs.items()}
+    return {port: future.result() for port,future in futures.items()}
+
+def discover(ports=None,addrs=(pcf85063a.PCF85063A_ADDR,),bus_factory=None):
+  """
+  Probe all given buses (default: all buses) in parallel for a PCF85063A
+  at the given addresses. Returns a sorted list of tuples (port,addr).
+  """
+  if ports is None:
+    ports = list_ports()
+  bus_factory = bus_factory or open_bus
+
+  def scan(port):
+    try:
+      bus = bus_factory(port)
+    except OSError:
+      return []
+    try:
+      return [(port,addr) for addr in addrs if probe(bus,addr)]
+    finally:
+      bus.close()
+
+  found = _run_parallel({port: (lambda port=port: scan(port))
+                         for port in ports})
+  return sorted(dev for devices in found.values() for dev in devices)
+
+class Fleet(object):
+  """
+  Group of PCF85063A-devices on one or more buses.
+  """
+
+  def __init__(self,devices,utc=True,bus_factory=None,lock_timeout=5.0):
+    """
+    constructor: devices is a list of tuples (port,addr), e.g. from
+    discover(). Every bus is opened once and shared by its devices.
+    Without lock_timeout, the buses are not locked.
+    """
+    bus_factory = bus_factory or open_bus
+    self._buses = {}
+    self.devices = []                       # list of (port,addr,rtc)
+    for port,addr in devices:
+      if port not in self._buses:
+        self._buses[port] = (bus_factory(port),
+                             pcf85063a.BusLock(port,lock_timeout)
+                             if lock_timeout else None)
+      bus, lock = self._buses[port]
+      self.devices.append(
+        (port,addr,pcf85063a.PCF85063A(port,utc,addr,bus=bus,lock=lock)))
+
+  def run(self,func,*args):
+    """
+    Execute func(rtc,*args) for all devices (one thread per bus). Returns
+    a list of tuples (port,addr,result,error,duration) in the order of
+    the devices. error is the exception raised by func (or None).
+    """
+    by_port = {}
+    for port,addr,rtc in self.devices:
+      by_port.setdefault(port,[]).append((addr,rtc))
+
+    def worker(port):
+      results = {}
+      for addr,rtc in by_port[port]:
+        start = time.monotonic()
+        try:
+          result, error = func(rtc,*args), None
+        except Exception as ex:
+          result, error = None, ex
+        results[addr] = (result,error,time.monotonic()-start)
+      return results
+
+    done = _run_parallel({port: (lambda port=port: worker(port))
+                          for port in by_port})
+    return [(port,addr) + done[port][addr]
+            for port,addr,_ in self.devices]
+
+  def call(self,method,*args):
+    """
+    Call the given method of PCF85063A for all devices, see run()
+    """
+    return self.run(lambda rtc: getattr(rtc,method)(*args))
+
+  def close(self):
+    """ close all buses """
+    for bus,_ in self._buses.values():
+      bus.close()
+    self._buses = {}
+
+  def __len__(self):
+    return len(self.devices)
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Minimal I2C-backend using the i2c-dev interface of the kernel.
+#
+# This module has no dependencies besides the standard library. It
+# implements the subset of the smbus.SMBus interface used by pcf85063a.py.
+# Register reads are combined write/read transactions (repeated start)
+# issued with a single I2C_RDWR ioctl, for arbitrary lengths.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, fcntl, ctypes
+
+I2C_RDWR = 0x0707                   # ioctl-request for combined transfers
+I2C_M_RD = 0x0001                   # message-flag: read
+
+class _I2CMsg(ctypes.Structure):
+  """ struct i2c_msg from linux/i2c.h """
+  _fields_ = [("addr",  ctypes.c_uint16),
+              ("flags", ctypes.c_uint16),
+              ("len",   ctypes.c_uint16),
+              ("buf",   ctypes.POINTER(ctypes.c_uint8))]
+
+class _I2CRdwrData(ctypes.Structure):
+  """ struct i2c_rdwr_ioctl_data from linux/i2c-dev.h """
+  _fields_ = [("msgs",  ctypes.POINTER(_I2CMsg)),
+              ("nmsgs", ctypes.c_uint32)]
+
+class I2CDev(object):
+  """
+  Access to /dev/i2c-<port> with the interface of smbus.SMBus.
+  """
+
+  def __init__(self,port):
+    """ constructor: open the device """
+    self._fd = os.open("/dev/i2c-%d" % port,os.O_RDWR)
+
+  def _transfer(self,addr,*messages):
+    """
+    Execute messages (tuples (flags,buffer)) as a single transaction
+    with repeated starts between the messages.
+    """
+    msgs = (_I2CMsg * len(messages))()
+    for msg,(flags,buf) in zip(msgs,messages):
+      msg.addr  = addr
+      msg.flags = flags
+      msg.len   = len(buf)
+      msg.buf   = ctypes.cast(buf,ctypes.POINTER(ctypes.c_uint8))
+    data = _I2CRdwrData(msgs,len(messages))
+    fcntl.ioctl(self._fd,I2C_RDWR,data)
+
+  def read_i2c_block_data(self,addr,register,length=32):
+    """ read length registers starting at register """
+    reg = (ctypes.c_uint8 * 1)(register)
+    buf = (ctypes.c_uint8 * length)()
+    self._transfer(addr,(0,reg),(I2C_M_RD,buf))
+    return list(buf)
+
+  def write_i2c_block_data(self,addr,register,data):
+    """ write data to registers starting at register """
+    buf = (ctypes.c_uint8 * (len(data)+1))(register,*data)
+    self._transfer(addr,(0,buf))
+
+  def read_byte_data(self,addr,register):
+    """ read a single register """
+    return self.read_i2c_block_data(addr,register,1)[0]
+
+  def write_byte_data(self,addr,register,value):
+    """ write a single register """
+    self.write_i2c_block_data(addr,register,[value])
+
+  def close(self):
+    """ close the device """
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Shared memory segment of the NTP SHM refclock driver.
+#
+# The segment (SysV shared memory, key 0x4E545030 + unit) is the interface
+# of ntpd and chronyd to external reference clocks. Samples are written in
+# mode 1: the writer increments count before and after updating the sample
+# and sets valid, the reader checks that count did not change while copying
+# and clears valid.
+#
+# chrony.conf: refclock SHM 2 refid RTC precision 1e-3
+#
+# Units 0 and 1 are only accessible by root (permissions 0600), units from
+# 2 on by all users (0666), like with ntpd.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, math, ctypes
+
+NTPD_BASE = 0x4E545030              # key of unit 0 ("NTP0")
+IPC_CREAT = 0o1000
+
+class _ShmTime(ctypes.Structure):
+  """ struct shmTime from ntpd (refclock_shm.c) """
+  _fields_ = [("mode",                 ctypes.c_int),
+              ("count",                ctypes.c_int),
+              ("clockTimeStampSec",    ctypes.c_long),     # time_t
+              ("clockTimeStampUSec",   ctypes.c_int),
+              ("receiveTimeStampSec",  ctypes.c_long),     # time_t
+              ("receiveTimeStampUSec", ctypes.c_int),
+              ("leap",                 ctypes.c_int),
+              ("precision",            ctypes.c_int),
+              ("nsamples",             ctypes.c_int),
+              ("valid",                ctypes.c_int),
+              ("clockTimeStampNSec",   ctypes.c_uint),
+              ("receiveTimeStampNSec", ctypes.c_uint),
+              ("dummy",                ctypes.c_int * 8)]
+
+def _split(timestamp):
+  """ split a timestamp into seconds and nanoseconds """
+  sec  = math.floor(timestamp)
+  nsec = min(int((timestamp-sec)*1e9),999999999)
+  return (sec,nsec)
+
+def precision(error):
+  """ return the precision (log2 of seconds) for the given error """
+  return math.ceil(math.log2(max(error,1e-9)))
+
+class SHMSegment(object):
+  """
+  SHM-segment of one unit of the refclock driver.
+  """
+
+  def __init__(self,unit=2,create=True):
+    """
+    constructor: attach the segment of the given unit (create it if
+    necessary and create is True)
+    """
+    self._libc = ctypes.CDLL(None,use_errno=True)
+    self._libc.shmat.restype  = ctypes.c_void_p
+    self._libc.shmat.argtypes = [ctypes.c_int,ctypes.c_void_p,ctypes.c_int]
+    self._libc.shmdt.argtypes = [ctypes.c_void_p]
+
+    flags = (0o600 if unit < 2 else 0o666) | (IPC_CREAT if create else 0)
+    shmid = self._libc.shmget(NTPD_BASE+unit,ctypes.sizeof(_ShmTime),flags)
+    if shmid == -1:
+      self._raise("shmget")
+    addr = self._libc.shmat(shmid,None,0)
+    if addr in (None,ctypes.c_void_p(-1).value):
+      self._raise("shmat")
+    self._addr = addr
+    self._shm  = _ShmTime.from_address(addr)
+    self.unit  = unit
+
+  def _raise(self,name):
+    """ raise an OSError for a failed call of the libc """
+    err = ctypes.get_errno()
+    raise OSError(err,"%s: %s" % (name,os.strerror(err)))
+
+  def write(self,clock_time,receive_time,prec=-10,leap=0):
+    """
+    Publish a sample: clock_time is the time of the reference clock and
+    receive_time the system time at the same moment (seconds since the
+    epoch). prec is the precision as log2 of seconds.
+    """
+    shm = self._shm
+    clock_sec, clock_nsec     = _split(clock_time)
+    receive_sec, receive_nsec = _split(receive_time)
+
+    shm.valid = 0
+    shm.mode  = 1
+    shm.count += 1
+    shm.clockTimeStampSec    = clock_sec
+    shm.clockTimeStampUSec   = clock_nsec // 1000
+    shm.clockTimeStampNSec   = clock_nsec
+    shm.receiveTimeStampSec  = receive_sec
+    shm.receiveTimeStampUSec = receive_nsec // 1000
+    shm.receiveTimeStampNSec = receive_nsec
+    shm.leap      = leap
+    shm.precision = prec
+    shm.count += 1
+    shm.valid = 1
+
+  def read(self,clear=False):
+    """
+    Read the current sample like the refclock driver. Returns a tuple
+    (clock_time,receive_time,precision,leap) or None if there is no valid
+    sample (or it changed while reading). With clear, the sample is
+    consumed (valid is cleared).
+    """
+    shm = self._shm
+    count = shm.count
+    if not shm.valid:
+      return None
+    sample = (shm.clockTimeStampSec + shm.clockTimeStampNSec/1e9,
+              shm.receiveTimeStampSec + shm.receiveTimeStampNSec/1e9,
+              shm.precision,shm.leap)
+    if shm.mode == 1 and shm.count != count:
+      return None
+    if clear:
+      shm.valid = 0
+    return sample
+
+  def close(self):
+    """ detach the segment """
+    if self._addr is not None:
+      self._shm = None
+      self._libc.shmdt(self._addr)
+      self._addr = None
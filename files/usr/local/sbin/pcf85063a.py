@@ -5,7 +5,8 @@
 #
 # This code does not support all functions of the PCF85063A. This is especially
 # relevant for alarms: periodic alarms are not supported at all, i.e. the
-# code assumes that alarms are set using specific datetime-values.
+# code assumes that alarms are set using specific datetime-values. For
+# periodic wakeups use the countdown timer instead.
 #
 # Original code from: https://github.com/switchdoclabs/RTC_SDL_DS3231
 # forked from:        https://github.com/conradstorz/RTC_SDL_DS3231
@@ -52,40 +53,181 @@
 # ---------------------- Original header ------------------------------------
 """
 
+import os
+import sys
 import time
-import smbus
+import fcntl
+import bisect
 from datetime import datetime, timedelta
-import arrow                                  # local/utc conversions
+
+# note: calendar and functools are not used, since their imports (locale,
+# re, collections) take longer than everything else at startup
 
 # set I2c bus addresses of clock module
 PCF85063A_ADDR = 0x51 #known versions of PCF85063A use 0x51
 
+# marker in the ram-byte: time was written by a host with synchronized time
+RAM_TIME_VALID = 0xA5
+
+# lockfile of an i2c-bus (shared by all processes using the bus)
+LOCK_FILE = "/run/lock/i2c-%d.lock"
+
+class BusLock(object):
+    """
+    Advisory lock (flock) of an i2c-bus, shared by all processes. The lock
+    is reentrant within a process and keeps statistics of the time callers
+    waited for the lock.
+    """
+
+    def __init__(self, port, timeout=5.0, path=None):
+        """
+        constructor. timeout is the maximum wait time in seconds.
+        """
+        self.path    = path or LOCK_FILE % port
+        self.timeout = timeout
+        self._fd     = None
+        self._depth  = 0
+        self.count      = 0             # number of acquisitions
+        self.contended  = 0             # number of acquisitions with waiting
+        self.wait_total = 0.0           # total wait time (seconds)
+        self.wait_max   = 0.0           # maximum wait time (seconds)
+
+    def _open(self):
+        """
+        Open (and create) the lockfile. The file is made writable for all
+        users regardless of the umask. flock also works on a read-only
+        descriptor, so a file created by another user with restrictive
+        permissions is opened read-only.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        except PermissionError:
+            return os.open(self.path, os.O_RDONLY)
+        try:
+            os.fchmod(fd, 0o666)
+        except PermissionError:
+            pass                        # owned by another user
+        return fd
+
+    def acquire(self):
+        """
+        Acquire the lock. Raises TimeoutError after timeout seconds.
+        """
+        if self._depth:
+            self._depth += 1
+            return
+        if self._fd is None:
+            self._fd = self._open()
+
+        start = time.monotonic()
+        delay = 0.0005
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() - start > self.timeout:
+                    raise TimeoutError('timeout waiting for lock %s' % self.path)
+                time.sleep(delay)
+                delay = min(2*delay, 0.02)
+
+        wait = time.monotonic() - start
+        self._depth = 1
+        self.count += 1
+        if delay > 0.0005:
+            self.contended += 1
+        self.wait_total += wait
+        self.wait_max    = max(self.wait_max, wait)
+
+    def release(self):
+        """
+        Release the lock.
+        """
+        self._depth -= 1
+        if not self._depth:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+def _locked(func):
+    """
+    Decorator: execute the method while holding the lock of the bus (and
+    account it as operation if instrumentation is on).
+    """
+    def wrapper(self, *args, **kwargs):
+        stats = self._stats
+        if stats is not None:
+            stats.enter(func.__name__)
+        try:
+            if self._lock is None:
+                return func(self, *args, **kwargs)
+            with self._lock:
+                return func(self, *args, **kwargs)
+        finally:
+            if stats is not None:
+                stats.leave()
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__  = func.__doc__
+    return wrapper
+
+def _timed(func):
+    """
+    Decorator: account the method as operation if instrumentation is on.
+    For methods which must not hold the lock (e.g. waiting for a tick).
+    """
+    def wrapper(self, *args, **kwargs):
+        stats = self._stats
+        if stats is None:
+            return func(self, *args, **kwargs)
+        stats.enter(func.__name__)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            stats.leave()
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__  = func.__doc__
+    return wrapper
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _timegm(dtime):
+    """
+    Return the seconds since the epoch of a naive utc-datetime (like
+    calendar.timegm()).
+    """
+    return (dtime - _EPOCH) // timedelta(seconds=1)
+
+# lookup tables for BCD conversion: decode all 256 byte values and
+# encode all one or two digit numbers
+_BCD_DECODE = tuple((b >> 4)*10 + (b & 0x0F) for b in range(256))
+_BCD_ENCODE = tuple(((n // 10) << 4) | (n % 10) for n in range(100))
+
 def _bcd_to_int(bcd):
     """
     Decode a 2x4bit BCD to a integer.
     """
-    out = 0
-    for digit in (bcd >> 4, bcd):
-        for value in (1, 2, 4, 8):
-            if digit & 1:
-                out += value
-            digit >>= 1
-        out *= 10
-    return int(out/10)
+    return _BCD_DECODE[bcd]
 
 
 def _int_to_bcd(number):
     """
     Encode a one or two digits number to the BCD format.
     """
-    bcd = 0
-    for idx in (number // 10, number % 10):
-        for value in (8, 4, 2, 1):
-            if idx >= value:
-                bcd += 1
-                idx -= value
-            bcd <<= 1
-    return bcd >> 1
+    return _BCD_ENCODE[number]
+
+
+def _bcd_block_to_int(regs, masks):
+    """
+    Decode a block of BCD registers. Each register is masked with the
+    respective value of masks before decoding.
+    """
+    return [_BCD_DECODE[reg & mask] for reg, mask in zip(regs, masks)]
 
 
 def _set_bit(value,index,state):
@@ -98,20 +240,417 @@ def _set_bit(value,index,state):
         value |= mask
     return value
 
+# --- alarm matching   -----------------------------------------------------
+
+def _days_in_month(year, month):
+    """
+    Number of days of the given month.
+    """
+    if month == 2:
+        return 29 if year % 4 == 0 and (year % 100 or year % 400 == 0) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
+
+def _next_tuple(fixed, limits, start):
+    """
+    Return the smallest tuple >= start (lexicographic order) with entries
+    equal to fixed (None: any value) and below limits, or None.
+    """
+    if not fixed:
+        return ()
+    value = start[0]
+    if fixed[0] is None or fixed[0] == value:
+        rest = _next_tuple(fixed[1:], limits[1:], start[1:])
+        if rest is not None:
+            return (value,) + rest
+    value = value + 1 if fixed[0] is None else fixed[0]
+    if value <= start[0] or value >= limits[0]:
+        return None
+    return (value,) + tuple(0 if f is None else f for f in fixed[1:])
+
+def _prev_tuple(fixed, limits, start):
+    """
+    Return the largest tuple <= start (lexicographic order) with entries
+    equal to fixed (None: any value) and below limits, or None.
+    """
+    if not fixed:
+        return ()
+    value = start[0]
+    if fixed[0] is None or fixed[0] == value:
+        rest = _prev_tuple(fixed[1:], limits[1:], start[1:])
+        if rest is not None:
+            return (value,) + rest
+    value = value - 1 if fixed[0] is None else fixed[0]
+    if value >= start[0] or value < 0:
+        return None
+    return (value,) + tuple(limit-1 if f is None else f
+                            for f, limit in zip(fixed[1:], limits[1:]))
+
+def _day_matches(date, day, wday):
+    """
+    Check if the date matches day-of-month and weekday (0: sunday).
+    None matches every value.
+    """
+    return ((day is None or date.day == day) and
+            (wday is None or date.isoweekday() % 7 == wday))
+
+def _match_day(date, day, wday, step):
+    """
+    Return the first date starting at date (step=1: forward, step=-1:
+    backward) matching day-of-month and weekday. Every combination of
+    day-of-month and weekday is found within a 28 year cycle, so the
+    number of iterations is bounded.
+    """
+    if day is None:
+        if wday is not None:
+            date += timedelta(days=step*((wday - date.isoweekday()) * step % 7))
+        return date
+
+    # move to the given day within the month (or the next/previous month)
+    year, month = date.year, date.month
+    if step > 0 and date.day > day:
+        month += 1
+    elif step < 0 and date.day < day:
+        month -= 1
+    for _ in range(12*28):
+        year += (month - 1) // 12
+        month = (month - 1) % 12 + 1
+        if day <= _days_in_month(year, month):
+            candidate = date.replace(year=year, month=month, day=day)
+            if _day_matches(candidate, day, wday):
+                return candidate
+        month += step
+    return None
+
+def _alarm_match(fields, now, fired):
+    """
+    Calculate the datetime of the next alarm after now (alarm did not fire
+    yet) or of the last alarm up to now (alarm fired). fields is a tuple
+    (sec, min, hour, day, weekday) with None for disabled fields. Returns
+    None if all fields are disabled.
+    """
+    sec, minute, hour, day, wday = fields
+    if fields == (None,) * 5:
+        return None
+    tod_fixed  = (hour, minute, sec)
+    tod_limits = (24, 60, 60)
+
+    if not fired:
+        start = now + timedelta(seconds=1)
+        tod = None
+        if _day_matches(start, day, wday):
+            tod = _next_tuple(tod_fixed, tod_limits,
+                              (start.hour, start.minute, start.second))
+        if tod is None:
+            start = _match_day(start.date() + timedelta(days=1), day, wday, 1)
+            tod = _next_tuple(tod_fixed, tod_limits, (0, 0, 0))
+    else:
+        start = now
+        tod = None
+        if _day_matches(start, day, wday):
+            tod = _prev_tuple(tod_fixed, tod_limits,
+                              (start.hour, start.minute, start.second))
+        if tod is None:
+            start = _match_day(start.date() - timedelta(days=1), day, wday, -1)
+            tod = _prev_tuple(tod_fixed, tod_limits, (23, 59, 59))
+    if start is None:
+        return None
+    return datetime(start.year, start.month, start.day, *tod)
+
+# correction per LSB of the offset register in ppm (normal mode: applied
+# every two hours, coarse mode: applied every four minutes)
+OFFSET_LSB_NORMAL = 4.34
+OFFSET_LSB_COARSE = 4.069
+
+def offset_to_ppm(value, coarse=False):
+    """
+    Convert a value of the offset register to the correction in ppm.
+    Positive values slow down the clock (negative correction), i.e. a
+    fast RTC needs a positive value.
+    """
+    return -value * (OFFSET_LSB_COARSE if coarse else OFFSET_LSB_NORMAL)
+
+def fit_drift(samples):
+    """
+    Fit the drift of the RTC in ppm (positive: RTC is fast) to a series of
+    (system time, RTC time) samples (seconds) using least squares.
+    """
+    n = len(samples)
+    if n < 2:
+        raise ValueError('at least two samples are necessary')
+    t0 = samples[0][0]
+    xs = [sys_t - t0 for sys_t, _ in samples]
+    ys = [rtc_t - sys_t for sys_t, rtc_t in samples]
+    mx = sum(xs) / n
+    my = sum(ys) / n
+    sxx = sum((x - mx)**2 for x in xs)
+    if not sxx:
+        raise ValueError('samples must span a time interval')
+    sxy = sum((x - mx)*(y - my) for x, y in zip(xs, ys))
+    return sxy / sxx * 1e6
+
+def best_offset(drift, value=0, coarse=False):
+    """
+    Calculate the best setting of the offset register for a drift (ppm)
+    measured with the given setting. Returns a tuple (value, coarse,
+    residual) with the residual drift in ppm. Normal mode is preferred
+    unless coarse mode is more precise.
+    """
+    raw = drift - offset_to_ppm(value, coarse)     # drift without correction
+    best = None
+    for mode, lsb in ((False, OFFSET_LSB_NORMAL), (True, OFFSET_LSB_COARSE)):
+        new_value = max(-64, min(63, int(round(raw / lsb))))
+        residual = raw - new_value * lsb
+        if best is None or abs(residual) < abs(best[2]):
+            best = (new_value, mode, residual)
+    return best
+
+# cache of utc-offset transitions of the local timezone (key: year)
+_offset_cache = {}
+
+def _local_zone():
+  """
+  Return the local timezone as tzinfo. Only used for years beyond the
+  range of time_t (e.g. from 2038 on with a 32-bit time_t), where
+  time.localtime() fails.
+  """
+  import zoneinfo
+  from datetime import timezone
+
+  key = os.environ.get("TZ","").lstrip(":")
+  if key:
+    try:
+      return zoneinfo.ZoneInfo(key)
+    except (ValueError,zoneinfo.ZoneInfoNotFoundError):
+      pass                                      # e.g. a POSIX TZ-string
+  try:
+    with open("/etc/localtime","rb") as f:
+      return zoneinfo.ZoneInfo.from_file(f)
+  except FileNotFoundError:
+    return timezone.utc
+
+def _local_offsets(year):
+  """
+  Return the utc-offset transitions of the local timezone for the given year
+  (plus one day on both sides) as a tuple (starts,offsets). starts are
+  utc-timestamps, offsets[i] is the utc-offset valid from starts[i] on.
+  """
+  if year in _offset_cache:
+    return _offset_cache[year]
+
+  ts  = _timegm(datetime(year,1,1)) - 86400
+  end = _timegm(datetime(year+1,1,1)) + 86400
+  try:
+    time.localtime(ts), time.localtime(end)
+    gmtoff = lambda t: time.localtime(t).tm_gmtoff
+  except (OverflowError, OSError):
+    zone = _local_zone()
+    gmtoff = lambda t: int(zone.fromutc(
+      (datetime(1970,1,1) + timedelta(seconds=t)).replace(tzinfo=zone)
+      ).utcoffset().total_seconds())
+  starts  = [ts]
+  offsets = [gmtoff(ts)]
+
+  # scan in steps of one day and bisect every change to the second
+  while ts < end:
+    nxt = min(ts+86400,end)
+    offset = gmtoff(nxt)
+    if offset != offsets[-1]:
+      lo, hi = ts, nxt
+      while hi - lo > 1:
+        mid = (lo+hi) // 2
+        if gmtoff(mid) == offsets[-1]:
+          lo = mid
+        else:
+          hi = mid
+      starts.append(hi)
+      offsets.append(offset)
+    ts = nxt
+
+  _offset_cache[year] = (starts,offsets)
+  return starts,offsets
+
 def _local2utc(dtime):
   """
-  Convert a naive datetime-object in local-time to UTC
+  Convert a naive datetime-object in local-time to UTC.
+
+  Ambiguous local times (end of DST) map to the first occurrence unless
+  dtime.fold is set. Missing local times (start of DST) use the offset
+  valid after the transition. Both match the conversion of arrow.
   """
-  a = arrow.get(dtime,'local')
-  return a.to('utc').naive
+  starts, offsets = _local_offsets(dtime.year)
+
+  lts  = _timegm(dtime)
+  last = len(starts) - 1
+  first = max(bisect.bisect_right(starts,lts-max(offsets))-1,0)
+  stop  = min(bisect.bisect_right(starts,lts-min(offsets)),last+1)
+
+  # collect all periods that contain the local time
+  valid = []
+  for i in range(first,stop):
+    uts = lts - offsets[i]
+    if starts[i] <= uts and (i == last or uts < starts[i+1]):
+      valid.append(i)
+
+  if len(valid) == 1:
+    offset = offsets[valid[0]]
+  elif valid:
+    offset = offsets[valid[min(dtime.fold,len(valid)-1)]]
+  else:
+    # time is within a gap: use offset after the transition
+    offset = offsets[0]
+    for i in range(max(first,1),stop):
+      if starts[i] + offsets[i-1] <= lts < starts[i] + offsets[i]:
+        offset = offsets[i]
+        break
+  return dtime.replace(fold=0) - timedelta(seconds=offset)
 
 def _utc2local(dtime):
   """
-  Convert a naive datetime-object in UTC to local-time
+  Convert a naive datetime-object in UTC to local-time. The second
+  occurrence of an ambiguous local time is marked with fold=1.
   """
-  a = arrow.get(dtime,'utc')
-  return a.to('local').naive
-  
+  starts, offsets = _local_offsets(dtime.year)
+
+  uts = _timegm(dtime)
+  i = bisect.bisect_right(starts,uts) - 1
+  local = dtime + timedelta(seconds=offsets[i])
+  if i > 0 and uts - starts[i] < offsets[i-1] - offsets[i]:
+    local = local.replace(fold=1)
+  return local
+
+class Snapshot(object):
+    """
+    Decoded copy of the complete register map (0x00-0x11), read with a
+    single transaction. Times are the raw values of the RTC (naive, UTC if
+    the RTC runs in UTC), disabled alarm fields are None.
+    """
+
+    __slots__ = ('raw', 'utc', '_t_read',
+                 # control_1
+                 'ext_test', 'stop', 'cie', 'mode_12h', 'cap_sel',
+                 # control_2
+                 'aie', 'af', 'mi', 'hmi', 'tf', 'cof',
+                 # offset and ram-byte
+                 'offset_coarse', 'offset', 'ram',
+                 # time
+                 'oscillator_stop', 'time', 'weekday',
+                 # alarm
+                 'alarm_sec', 'alarm_min', 'alarm_hour', 'alarm_day',
+                 'alarm_wday',
+                 # timer
+                 'timer_value', 'timer_clock', 'timer_enabled',
+                 'timer_interrupt', 'timer_pulse')
+
+    def __init__(self, regs, utc=True):
+        """
+        constructor: decode the registers 0x00-0x11
+        """
+        self.raw = list(regs)
+        self.utc = utc
+        self._t_read = time.monotonic()
+
+        c1, c2, offset = regs[0:3]
+        self.ext_test = bool(c1 & 0x80)
+        self.stop     = bool(c1 & 0x20)
+        self.cie      = bool(c1 & 0x04)
+        self.mode_12h = bool(c1 & 0x02)
+        self.cap_sel  = c1 & 0x01
+
+        self.aie = bool(c2 & 0x80)
+        self.af  = bool(c2 & 0x40)
+        self.mi  = bool(c2 & 0x20)
+        self.hmi = bool(c2 & 0x10)
+        self.tf  = bool(c2 & 0x08)
+        self.cof = c2 & 0x07
+
+        self.offset_coarse = bool(offset & 0x80)
+        self.offset = (offset & 0x7F) - (0x80 if offset & 0x40 else 0)
+        self.ram = regs[3]
+
+        (seconds, minutes, hours, date,
+         day, month, year) = _bcd_block_to_int(regs[4:11],
+                                               PCF85063A._TIME_MASKS)
+        self.oscillator_stop = bool(regs[4] & 0x80)
+        self.weekday = day
+        try:
+            self.time = datetime(2000 + year, month, date,
+                                 hours, minutes, seconds)
+        except ValueError:
+            self.time = None                          # invalid registers
+
+        (self.alarm_sec, self.alarm_min, self.alarm_hour,
+         self.alarm_day, self.alarm_wday) = [
+            None if reg & 0x80 else _bcd_to_int(reg & mask)
+            for reg, mask in zip(regs[11:16], (0x7F, 0x7F, 0x3F, 0x3F, 0x07))]
+
+        mode = regs[17]
+        self.timer_value     = regs[16]
+        self.timer_clock     = (mode >> 3) & 0x03
+        self.timer_enabled   = bool(mode & 0x04)
+        self.timer_interrupt = bool(mode & 0x02)
+        self.timer_pulse     = bool(mode & 0x01)
+
+    def _local(self, dtime):
+        """
+        Convert a time of the RTC to local time
+        """
+        if dtime is None or not self.utc:
+            return dtime
+        return _utc2local(dtime)
+
+    def local_time(self):
+        """
+        Return the time of the RTC as local datetime (None if invalid).
+        """
+        return self._local(self.time)
+
+    def epoch(self):
+        """
+        Return the time of the RTC as seconds since the epoch.
+        """
+        dtime = self.time if self.utc else _local2utc(self.time)
+        return _timegm(dtime)
+
+    def time_valid(self):
+        """
+        Check if the time was written by a host with synchronized time
+        (marker in the ram-byte) and the oscillator did not stop since.
+        """
+        return (self.ram == RAM_TIME_VALID and not self.oscillator_stop and
+                self.time is not None)
+
+    def alarm_time(self):
+        """
+        Return the next (or last if fired) alarm as local datetime, see
+        PCF85063A.get_alarm_time().
+        """
+        if self.time is None:
+            return None
+        fields = (self.alarm_sec, self.alarm_min, self.alarm_hour,
+                  self.alarm_day, self.alarm_wday)
+        return self._local(_alarm_match(fields, self.time, self.af))
+
+    def timer_period(self):
+        """
+        Return the period of the countdown timer in seconds.
+        """
+        return self.timer_value / PCF85063A.TIMER_FREQUENCIES[self.timer_clock]
+
+    def to_dict(self):
+        """
+        Return all fields as dict (e.g. for json). Times are returned as
+        ISO 8601 strings.
+        """
+        result = {}
+        for name in self.__slots__:
+            if name.startswith('_'):
+                continue
+            value = getattr(self, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            result[name] = value
+        return result
+
 class PCF85063A(object):
     """
     Define the methods needed to read and update the real-time-clock module.
@@ -125,6 +664,10 @@ class PCF85063A(object):
     _MONTH_REGISTER        = 0x09
     _YEAR_REGISTER         = 0x0A
 
+    # masks for the time registers 0x04-0x0A (sec, min, hour, day,
+    # weekday, month, year)
+    _TIME_MASKS            = (0x7F, 0x7F, 0x3F, 0x3F, 0x07, 0x1F, 0xFF)
+
     _ALARM_OFFSET         = 0x0B
     _ALARM_SEC_REGISTER   = 0x0B
     _ALARM_MIN_REGISTER   = 0x0C
@@ -132,15 +675,136 @@ class PCF85063A(object):
     _ALARM_DATE_REGISTER  = 0x0E
     _ALARM_WDAY_REGISTER  = 0x0F
 
+    _CONTROL1_REGISTER      = 0x00
     _CONTROL2_REGISTER      = 0x01
+    _OFFSET_REGISTER        = 0x02
+    _RAM_REGISTER           = 0x03
+    _TIMER_VALUE_REGISTER   = 0x10
+    _TIMER_MODE_REGISTER    = 0x11
 
-    def __init__(self,port,utc=True,addr=PCF85063A_ADDR):
+    # clock sources of the countdown timer (TCF-bits of timer-mode)
+    TIMER_4096HZ            = 0
+    TIMER_64HZ              = 1
+    TIMER_1HZ               = 2
+    TIMER_1_60HZ            = 3
+    TIMER_FREQUENCIES       = (4096, 64, 1, 1/60)
+
+    _REGISTER_COUNT         = 0x12        # register map: 0x00-0x11
+
+    # STOP-bit of control_1: stops the clock and resets the divider chain.
+    # The first increment of the time registers happens 0.507813s to
+    # 0.507935s after STOP is released (datasheet, section 8.2.2)
+    _STOP_BIT               = 0x20
+    _STOP_RELEASE_DELAY     = 0.507874
+
+    def __init__(self,port,utc=True,addr=PCF85063A_ADDR,bus=None,lock=None,
+                 stats=None):
         """
-        constructor
+        constructor. bus is an optional object with the interface of
+        smbus.SMBus (e.g. smbus.SMBus or pcf85063a_sim.SimBus). The
+        default is i2cdev.I2CDev for the given port.
+        lock is an optional BusLock. Without a bus, the default is
+        a BusLock for the given port, otherwise no locking is done.
+        stats is an optional pcf85063a_stats.Stats, see set_stats().
         """
-        self._bus = smbus.SMBus(port)
+        if bus is None:
+            import i2cdev
+            bus = i2cdev.I2CDev(port)
+            if lock is None:
+                lock = BusLock(port)
+        self._bus = bus
+        self._raw_bus = bus
+        self._stats = None
+        self._lock = lock
         self._utc = utc
         self._addr = addr
+        self._shadow = [None] * self._REGISTER_COUNT
+        self._dirty  = set()
+        self._batch  = 0
+        if stats is not None:
+            self.set_stats(stats)
+
+    def set_stats(self, stats):
+        """
+        Turn instrumentation on (stats is a pcf85063a_stats.Stats) or off
+        (stats is None). With instrumentation, every bus-transaction and
+        every operation (public methods and batches) is accounted.
+        """
+        if stats is None:
+            self._bus = self._raw_bus
+        else:
+            import pcf85063a_stats
+            self._bus = pcf85063a_stats.InstrumentedBus(self._raw_bus, stats)
+        self._stats = stats
+
+    def get_stats(self):
+        """
+        Return the pcf85063a_stats.Stats-object or None.
+        """
+        return self._stats
+
+    ###########################
+    # register shadow
+    ###########################
+
+    def __enter__(self):
+        """
+        Start a batch of register operations. Within a batch, writes only
+        update the shadow of the register map and reads are served from the
+        shadow once a register is known. Pending writes are flushed when
+        the outermost batch ends. Batches can be nested. The lock of the
+        bus is held during the batch. With instrumentation, the batch is
+        accounted as operation named after the calling function.
+        """
+        if not self._batch:
+            if self._lock:
+                self._lock.acquire()
+            self._shadow = [None] * self._REGISTER_COUNT
+        self._batch += 1
+        if self._stats is not None:
+            self._stats.enter(sys._getframe(1).f_code.co_name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        End a batch. Pending writes are discarded if the batch failed.
+        """
+        self._batch -= 1
+        try:
+            if not self._batch:
+                try:
+                    if exc_type is None:
+                        self.flush()
+                finally:
+                    self._dirty.clear()
+                    self._shadow = [None] * self._REGISTER_COUNT
+                    if self._lock:
+                        self._lock.release()
+        finally:
+            if self._stats is not None:
+                self._stats.leave()
+        return False
+
+    def flush(self):
+        """
+        Write all dirty registers of the shadow to the device. Every
+        contiguous range of dirty registers is written with a single
+        transaction.
+        """
+        dirty = sorted(self._dirty)
+        start = 0
+        while start < len(dirty):
+            end = start
+            while end+1 < len(dirty) and dirty[end+1] == dirty[end]+1:
+                end += 1
+            first = dirty[start]
+            data  = self._shadow[first:dirty[end]+1]
+            if len(data) == 1:
+                self._bus.write_byte_data(self._addr, first, data[0])
+            else:
+                self._write_block(first, data)
+            self._dirty.difference_update(dirty[start:end+1])
+            start = end + 1
 
     ###########################
     # PCF85063A real time clock functions
@@ -148,16 +812,34 @@ class PCF85063A(object):
     
     def _write(self, register, data):
         """
-        ???
+        Write a single register. Within a batch, only the shadow is updated.
         """
-        self._bus.write_byte_data(self._addr, register, data)
+        if self._batch:
+            self._shadow[register] = data
+            self._dirty.add(register)
+        else:
+            self._bus.write_byte_data(self._addr, register, data)
 
     def _read(self, data):
         """
-        ???
+        Read a single register. Within a batch, known values are served
+        from the shadow.
         """
+        if self._batch:
+            value = self._shadow[data]
+            if value is None:
+                value = self._bus.read_byte_data(self._addr, data)
+                self._shadow[data] = value
+            return value
         return self._bus.read_byte_data(self._addr, data)
 
+    def _write_block(self, register, data):
+        """
+        Write consecutive registers starting at register in a single
+        transaction.
+        """
+        self._bus.write_i2c_block_data(self._addr, register, list(data))
+
     def _read_seconds(self):
         """
         ???
@@ -200,29 +882,59 @@ class PCF85063A(object):
         """
         return _bcd_to_int(self._read(self._YEAR_REGISTER))
 
+    def _read_block(self, register, length):
+        """
+        Read length consecutive registers starting at register in a
+        single transaction.
+        """
+        regs = self._bus.read_i2c_block_data(self._addr, register, length)
+        if self._batch:
+            # pending writes take precedence over device values
+            regs = list(regs)
+            for i in range(length):
+                if register+i in self._dirty:
+                    regs[i] = self._shadow[register+i]
+                else:
+                    self._shadow[register+i] = regs[i]
+        return regs
+
+    def _read_time_registers(self):
+        """
+        Read the time registers (0x04-0x0A) with a single block read and
+        return a tuple (year, month, daynum, dayname, hours, minutes, seconds).
+        Since all values are from the same snapshot, a roll-over of the
+        seconds while reading cannot tear the result.
+        """
+        (seconds, minutes, hours, date,
+         day, month, year) = _bcd_block_to_int(
+             self._read_block(self._SECONDS_REGISTER, 7), self._TIME_MASKS)
+        return (year, month, date, day, hours, minutes, seconds)
+
+    @_locked
     def read_all(self):
         """
         Return a tuple such as (year, month, daynum, dayname, hours, minutes, seconds).
         """
-        return (self._read_year(), self._read_month(), self._read_date(),
-                self._read_day(), self._read_hours(), self._read_minutes(),
-                self._read_seconds())
+        return self._read_time_registers()
 
+    @_locked
     def read_str(self):
         """
         Return a string such as 'YY-DD-MMTHH-MM-SS'.
         """
-        return '%02d-%02d-%02dT%02d:%02d:%02d' % (self._read_year(),
-                self._read_month(), self._read_date(), self._read_hours(),
-                self._read_minutes(), self._read_seconds())
+        (year, month, date, _, hours,
+         minutes, seconds) = self._read_time_registers()
+        return '%02d-%02d-%02dT%02d:%02d:%02d' % (year, month, date,
+                                                  hours, minutes, seconds)
 
+    @_locked
     def read_datetime(self):
         """
         Return the datetime.datetime object.
         """
-        dtime =  datetime(2000 + self._read_year(),
-                self._read_month(), self._read_date(), self._read_hours(),
-                self._read_minutes(), self._read_seconds(), 0)
+        (year, month, date, _, hours,
+         minutes, seconds) = self._read_time_registers()
+        dtime =  datetime(2000 + year, month, date, hours, minutes, seconds, 0)
         if (self._utc):
           return _utc2local(dtime)
         else:
@@ -235,190 +947,379 @@ class PCF85063A(object):
         Range: seconds [0,59], minutes [0,59], hours [0,23],
                  day_of_week [0,7], day_of_month [1-31], month [1-12], year [0-99].
         """
-        if seconds is not None:
-            if seconds < 0 or seconds > 59:
-                raise ValueError('Seconds is out of range [0,59].')
-            seconds_reg = _int_to_bcd(seconds)
-            self._write(self._SECONDS_REGISTER, seconds_reg)
+        with self:
+            if seconds is not None:
+                if seconds < 0 or seconds > 59:
+                    raise ValueError('Seconds is out of range [0,59].')
+                seconds_reg = _int_to_bcd(seconds)
+                self._write(self._SECONDS_REGISTER, seconds_reg)
 
-        if minutes is not None:
-            if minutes < 0 or minutes > 59:
-                raise ValueError('Minutes is out of range [0,59].')
-            self._write(self._MINUTES_REGISTER, _int_to_bcd(minutes))
+            if minutes is not None:
+                if minutes < 0 or minutes > 59:
+                    raise ValueError('Minutes is out of range [0,59].')
+                self._write(self._MINUTES_REGISTER, _int_to_bcd(minutes))
 
-        if hours is not None:
-            if hours < 0 or hours > 23:
-                raise ValueError('Hours is out of range [0,23].')
-            self._write(self._HOURS_REGISTER, _int_to_bcd(hours)) # not  | 0x40 according to datasheet
+            if hours is not None:
+                if hours < 0 or hours > 23:
+                    raise ValueError('Hours is out of range [0,23].')
+                self._write(self._HOURS_REGISTER, _int_to_bcd(hours)) # not  | 0x40 according to datasheet
 
-        if year is not None:
-            if year < 0 or year > 99:
-                raise ValueError('Years is out of range [0, 99].')
-            self._write(self._YEAR_REGISTER, _int_to_bcd(year))
+            if year is not None:
+                if year < 0 or year > 99:
+                    raise ValueError('Years is out of range [0, 99].')
+                self._write(self._YEAR_REGISTER, _int_to_bcd(year))
 
-        if month is not None:
-            if month < 1 or month > 12:
-                raise ValueError('Month is out of range [1, 12].')
-            self._write(self._MONTH_REGISTER, _int_to_bcd(month))
+            if month is not None:
+                if month < 1 or month > 12:
+                    raise ValueError('Month is out of range [1, 12].')
+                self._write(self._MONTH_REGISTER, _int_to_bcd(month))
 
-        if day_of_month is not None:
-            if day_of_month < 1 or day_of_month > 31:
-                raise ValueError('Day_of_month is out of range [1, 31].')
-            self._write(self._DAY_OF_MONTH_REGISTER, _int_to_bcd(day_of_month))
+            if day_of_month is not None:
+                if day_of_month < 1 or day_of_month > 31:
+                    raise ValueError('Day_of_month is out of range [1, 31].')
+                self._write(self._DAY_OF_MONTH_REGISTER, _int_to_bcd(day_of_month))
 
-        if day_of_week is not None:
-            if day_of_week < 1 or day_of_week > 7:
-                raise ValueError('Day_of_week is out of range [1, 7].')
-            self._write(self._DAY_OF_WEEK_REGISTER, _int_to_bcd(day_of_week))
+            if day_of_week is not None:
+                if day_of_week < 0 or day_of_week > 7:
+                    raise ValueError('Day_of_week is out of range [0, 7].')
+                # the RTC counts 0-6 (0: sunday), 7 is accepted for sunday
+                self._write(self._DAY_OF_WEEK_REGISTER, day_of_week % 7)
 
-    def write_datetime(self, dtime):
+    def write_datetime(self, dtime, valid=False):
         """
-        Write from a datetime.datetime object.
+        Write from a datetime.datetime object. With valid, the time is
+        marked as valid in the ram-byte, otherwise the marker is cleared.
         """
         if(self._utc):
             dtime = _local2utc(dtime)
 
-        self.write_all(dtime.second, dtime.minute, dtime.hour,
-                dtime.isoweekday(), dtime.day, dtime.month, dtime.year % 100)
+        with self:
+            self.write_all(dtime.second, dtime.minute, dtime.hour,
+                    dtime.isoweekday(), dtime.day, dtime.month, dtime.year % 100)
+            self._write(self._RAM_REGISTER, RAM_TIME_VALID if valid else 0)
 
-    def write_system_datetime_now(self):
+    def write_system_datetime_now(self, valid=False):
         """
         shortcut version of "PCF85063A.write_datetime(datetime.datetime.now())".
         """
-        self.write_datetime(datetime.now())
+        self.write_datetime(datetime.now(), valid)
 
-    #######################################################################
-    # SDL_PCF85063A alarm handling. Recurring alarms are currently unsupported.
-    ########################################################################
-    
-    def set_alarm_time(self,dtime):
+    @_locked
+    def get_time_valid(self):
         """
-        Set alarm to given time-point. Note: although this method has a
-        full datetime-value as input, only the values of day-of-month,
-        hours, minutes and seconds (only alarm) are used
-        Also disables weekday-alarm bit.
+        Check if the time was written by a host with synchronized time, see
+        Snapshot.time_valid().
         """
-        if (self._utc):
+        ram, seconds = self._read_block(self._RAM_REGISTER, 2)
+        return ram == RAM_TIME_VALID and not seconds & 0x80
+
+    @_locked
+    def set_time_valid(self, valid=True):
+        """
+        Set or clear the marker for a valid time in the ram-byte.
+        """
+        self._write(self._RAM_REGISTER, RAM_TIME_VALID if valid else 0)
+
+    @_locked
+    def _read_epoch(self):
+        """
+        Read the time registers and return the RTC-time as seconds since
+        the epoch.
+        """
+        (year, month, date, _, hours,
+         minutes, seconds) = self._read_time_registers()
+        dtime = datetime(2000 + year, month, date, hours, minutes, seconds)
+        if not self._utc:
             dtime = _local2utc(dtime)
+        return _timegm(dtime)
 
-        self._write(self._ALARM_SEC_REGISTER, _int_to_bcd(dtime.second))
-        self._write(self._ALARM_MIN_REGISTER, _int_to_bcd(dtime.minute))
-        self._write(self._ALARM_HOUR_REGISTER, _int_to_bcd(dtime.hour))
-        self._write(self._ALARM_DATE_REGISTER, _int_to_bcd(dtime.day))
-        self._write(self._ALARM_WDAY_REGISTER, 0x80)
+    @_locked
+    def set_system_datetime(self, snapshot=None):
+        """
+        Set the system clock from the RTC (or a Snapshot of the RTC) using
+        clock_settime(). The time passed between reading the RTC and setting
+        the clock is added. Returns the correction (in seconds) applied to
+        the system clock.
+        """
+        if snapshot:
+            rtc_time, t_read = snapshot.epoch(), snapshot._t_read
+        else:
+            rtc_time = self._read_epoch()
+            t_read = time.monotonic()
 
-    def get_alarm_time(self):
+        new_time = rtc_time + (time.monotonic() - t_read)
+        correction = new_time - time.time()
+        time.clock_settime(time.CLOCK_REALTIME, new_time)
+        return correction
+
+    ###########################
+    # offset register (calibration)
+    ###########################
+
+    @_locked
+    def get_offset(self):
         """
-        Query the given alarm and construct a valid datetime-object.
-        Return None if no valid alarm has been set.
+        Return the offset register as tuple (value, coarse). value is the
+        signed offset [-64,63], coarse the state of the MODE bit.
         """
+        reg = self._read(self._OFFSET_REGISTER)
+        value = reg & 0x7F
+        if value & 0x40:
+            value -= 0x80
+        return (value, bool(reg & 0x80))
 
-        # seconds
-        buffer = self._read(self._ALARM_SEC_REGISTER)
-        if buffer & 0x80:
-            return None
-        sec = _bcd_to_int(buffer & 0x7F)
-        offset = self._ALARM_OFFSET + 1
+    @_locked
+    def set_offset(self, value, coarse=False):
+        """
+        Set the offset register (value: [-64,63], coarse: MODE bit).
+        """
+        if value < -64 or value > 63:
+            raise ValueError('Offset is out of range [-64,63].')
+        self._write(self._OFFSET_REGISTER, (0x80 if coarse else 0) | (value & 0x7F))
 
-        # minutes
-        buffer = self._read(offset)
-        if buffer & 0x80:
-            return None
-        min  = _bcd_to_int(buffer & 0x7F)
+    @_locked
+    def calibrate(self, samples):
+        """
+        Fit the drift of the RTC to the (system time, RTC time) samples and
+        program the best offset. Returns a tuple (drift, value, coarse,
+        residual) with drift and residual in ppm.
+        """
+        drift = fit_drift(samples)
+        value, coarse = self.get_offset()
+        value, coarse, residual = best_offset(drift, value, coarse)
+        self.set_offset(value, coarse)
+        return (drift, value, coarse, residual)
 
-        # hour
-        offset = offset + 1
-        buffer = self._read(offset)
-        if buffer & 0x80:
-            return None
-        hour = _bcd_to_int(buffer & 0x7F)
+    ###########################
+    # precise synchronization
+    ###########################
+
+    def write_system_datetime_precise(self, lead=0.0005, valid=False):
+        """
+        Write the system time to the RTC in phase with the system clock.
+        Writing the time registers does not reset the divider of the
+        PCF85063A, so the clock is stopped (STOP-bit, resets the divider),
+        the time registers are written and STOP is released
+        _STOP_RELEASE_DELAY before the next full second of the system
+        clock, i.e. the first increment of the RTC coincides with the
+        start of that second. lead is the estimated time (in seconds) the
+        transaction needs until the control register is written. The
+        ram-byte is written together with the time registers (see
+        write_datetime()). Returns the system time of the release.
+        """
+        target = int(time.time()) + 1       # first increment of the RTC
+        if target - self._STOP_RELEASE_DELAY - time.time() < 0.05:
+            target += 1                     # not enough time to prepare
+        t_release = target - self._STOP_RELEASE_DELAY - lead
+
+        # until the first increment, the RTC shows the previous second
+        dtime = datetime(1970, 1, 1) + timedelta(seconds=target-1)
+        if not self._utc:
+            dtime = _utc2local(dtime)
+        regs = [RAM_TIME_VALID if valid else 0,
+                _int_to_bcd(dtime.second), _int_to_bcd(dtime.minute),
+                _int_to_bcd(dtime.hour), _int_to_bcd(dtime.day),
+                dtime.isoweekday() % 7, _int_to_bcd(dtime.month),
+                _int_to_bcd(dtime.year % 100)]
+
+        # sleep most of the time, then busy-wait for the exact moment
+        delay = t_release - time.time() - 0.02
+        if delay > 0:
+            time.sleep(delay)
+        with self:
+            control = self._read(self._CONTROL1_REGISTER) & ~self._STOP_BIT
+            self._bus.write_byte_data(self._addr, self._CONTROL1_REGISTER,
+                                      control | self._STOP_BIT)
+            try:
+                self._write_block(self._RAM_REGISTER, regs)
+                while time.time() < t_release:
+                    pass
+            finally:
+                # never leave the clock stopped
+                t_write = time.time()
+                self._bus.write_byte_data(self._addr,
+                                          self._CONTROL1_REGISTER, control)
+        return t_write
 
-        # day-in-month
-        offset = offset + 1
-        buffer = self._read(offset)
-        if buffer & 0x80:
+    def lock_stats(self):
+        """
+        Return statistics of the bus-lock as tuple (count, contended,
+        wait_total, wait_max) or None without lock.
+        """
+        if self._lock is None:
             return None
-        day = _bcd_to_int(buffer & 0x3F)
+        return (self._lock.count, self._lock.contended,
+                self._lock.wait_total, self._lock.wait_max)
+
+    def _read_seconds_at(self):
+        """
+        Read the seconds register. Returns a tuple (value,t) with t the
+        system time in the middle of the transaction.
+        """
+        t_start = time.time()
+        value = self._read(self._SECONDS_REGISTER)
+        return (value, (t_start + time.time())/2)
+
+    def _wait_for_tick(self, precision=0.001, timeout=3.0):
+        """
+        Poll the seconds register until it changes. The first edge found
+        with coarse polling is only used to predict the next one, which is
+        then polled with an interval of precision. Returns a tuple
+        (t_edge, error) with the system time of the edge and its
+        uncertainty.
+        """
+        deadline = time.time() + timeout
+        interval = 0.05
+        last, t_last = self._read_seconds_at()
+        while t_last < deadline:
+            time.sleep(interval)
+            value, t_now = self._read_seconds_at()
+            if value == last:
+                t_last = t_now
+                continue
+            if interval == precision:
+                return ((t_last + t_now)/2, (t_now - t_last)/2)
 
-        return self._next_dt_match(day,hour,min,sec)
+            # edge is in [t_last,t_now], so the next one will be one second
+            # later: wait until shortly before and poll with high frequency
+            delay = t_last + 1 - 2*precision - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            last, t_last = self._read_seconds_at()
+            interval = precision
+        raise TimeoutError('no tick of the RTC detected')
 
-    def _next_dt_match(self,day,hour,min,sec):
+    def read_datetime_precise(self, precision=0.001):
         """
-        Calculate the next alarm datetime (in case alarm did not fire yet)
-        or the last datetime if the alarm fired.
-        The former is exact while the latter is just a best guess - the
-        alarm could already have fired way in the past.
+        Wait for the next tick of the RTC and return a tuple (dtime,t_edge)
+        with the RTC-datetime and the system time (seconds since the epoch)
+        at the tick.
+        """
+        t_edge, _ = self._wait_for_tick(precision)
+        return (self.read_datetime(), t_edge)
+
+    @_timed
+    def measure_offset(self, precision=0.001):
+        """
+        Return the offset of the RTC to the system time in seconds
+        (positive if the RTC is ahead), measured at a tick of the RTC.
+        """
+        t_edge, rtc_time = self.sample(precision)
+        return rtc_time - t_edge
+
+    @_timed
+    def sample(self, precision=0.001):
+        """
+        Return a tuple (system time, RTC time) (seconds since the epoch)
+        taken at a tick of the RTC, e.g. as sample for calibrate().
+        """
+        t_edge, _ = self._wait_for_tick(precision)
+        return (t_edge, self._read_epoch())
+
+    def watch(self, precision=0.001, guard=0.005):
+        """
+        Generator following the ticks of the RTC. Yields a tuple (system
+        time, RTC time, error) (seconds since the epoch) for every tick.
+        Between ticks, the generator sleeps until guard seconds before the
+        predicted edge and then polls with an interval of precision. A
+        missed edge (e.g. on a loaded system or a slow bus) doubles the
+        guard, every detected edge shrinks it again, but not below 1.5
+        times the guard that failed.
+        """
+        min_guard = guard
+        t_edge, error = self._wait_for_tick(precision)
+        while True:
+            last, _ = self._read_seconds_at()
+            yield (t_edge, self._read_epoch(), error)
+
+            delay = t_edge + 1 - guard - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            value, t_last = self._read_seconds_at()
+            if value != last:
+                # woke up too late: resynchronize with a larger guard
+                min_guard = min(1.5*guard, 0.25)
+                guard = min(2*guard, 0.25)
+                t_edge, error = self._wait_for_tick(precision)
+                continue
+
+            deadline = t_last + 2*guard + 1
+            while value == last:
+                if t_last > deadline:
+                    raise TimeoutError('no tick of the RTC detected')
+                time.sleep(precision)
+                value, t_now = self._read_seconds_at()
+                if value == last:
+                    t_last = t_now
+            t_edge, error = (t_last + t_now)/2, (t_now - t_last)/2
+            guard = max(0.9*guard, min_guard)
+
+    #######################################################################
+    # SDL_PCF85063A alarm handling. Recurring alarms are currently unsupported.
+    ########################################################################
+    
+    def set_alarm_time(self,dtime):
+        """
+        Set alarm to given time-point. Note: although this method has a
+        full datetime-value as input, only the values of day-of-month,
+        hours, minutes and seconds (only alarm) are used
+        Also disables weekday-alarm bit.
         """
         if (self._utc):
-            now = datetime.utcnow()
-        else:
-            now = datetime.now()
-        year = now.year
-        month = now.month
+            dtime = _local2utc(dtime)
 
-        enabled,fired = self.get_alarm_state()
+        with self:
+            self._write(self._ALARM_SEC_REGISTER, _int_to_bcd(dtime.second))
+            self._write(self._ALARM_MIN_REGISTER, _int_to_bcd(dtime.minute))
+            self._write(self._ALARM_HOUR_REGISTER, _int_to_bcd(dtime.hour))
+            self._write(self._ALARM_DATE_REGISTER, _int_to_bcd(dtime.day))
+            self._write(self._ALARM_WDAY_REGISTER, 0x80)
 
-        # first try: assume alarm is in the curren month
-        # we try to create a valid datetime object
-        try:
-            alarm_dtime = datetime(year,month,day,hour,min,sec)
-        except ValueError:
-            # day-of-month might not be valid for current month!
-            # no year roll-over necessary, since this won't happen
-            # for December or January
-            if fired:
-                month = month - 1         # alarm must have been in the past
-            else:
-                month = month + 1         # alarm date is in the future
-            alarm_dtime = datetime(year,month,day,hour,min,sec)
-
-        # check if first alarm-datetime is correct
-        # this depends on the state of the alarm
-        if now > alarm_dtime and not fired:
-            # alarm did not fire yet, but must be in the future
-            month = month + 1
-            if month > 12:
-                month = 1
-                year  = year + 1
-        elif now < alarm_dtime and fired:
-            # alarm fired, but must be in the past
-            month = month - 1
-            if month == 0:
-                month = 12
-                year = year - 1
-        else:
-            # proper alignment of now and alarm_dtime, so return it
-            if (self._utc):
-                return _utc2local(alarm_dtime)
-            else:
-                return alarm_dtime
+    @_locked
+    def get_alarm_time(self):
+        """
+        Query the given alarm and construct a valid datetime-object: the
+        next alarm (in case the alarm did not fire yet) or the last alarm
+        if the alarm fired. The latter is just a best guess - the alarm
+        could already have fired way in the past. Disabled alarm fields
+        match every value. Return None if no alarm field is enabled or the
+        time registers do not contain a valid date.
 
-        # second try: we moved the alarm one month, but the day-of-month
-        # might not be valid for the new month
+        Control_2, the time and the alarm registers are read with a single
+        transaction and the alarm is matched against the time of the RTC.
+        """
+        regs = self._read_block(self._CONTROL2_REGISTER,
+                                self._ALARM_WDAY_REGISTER -
+                                self._CONTROL2_REGISTER + 1)
+        fired = bool(regs[0] & 0x40)
+        (seconds, minutes, hours, date,
+         _, month, year) = _bcd_block_to_int(regs[3:10], self._TIME_MASKS)
         try:
-            alarm_dtime = datetime(year,month,day,hour,min,sec)
+            now = datetime(2000 + year, month, date, hours, minutes, seconds)
         except ValueError:
-            # again, no year roll-over necessary
-            if fired:
-                month = month - 1      # alarm is in the past, go back in time
-            else:
-                month = month + 1      # alarm waiting, i.e. in the future
-            alarm_dtime = datetime(year,month,day,hour,min,sec)
+            return None                                 # invalid registers
 
-        if (self._utc):
-          return _utc2local(alarm_dtime)
-        else:
-          return alarm_dtime
+        fields = []
+        for reg, mask in zip(regs[10:15], (0x7F, 0x7F, 0x3F, 0x3F, 0x07)):
+            fields.append(None if reg & 0x80 else _bcd_to_int(reg & mask))
+
+        alarm_dtime = _alarm_match(tuple(fields), now, fired)
+        if alarm_dtime and self._utc:
+            return _utc2local(alarm_dtime)
+        return alarm_dtime
 
+    @_locked
     def get_alarm_state(self):
         """
         Query if the state of the alarm. Returns a tuple (enabled,fired)
         of two booleans.
         """
-        enabled = self._read(self._CONTROL2_REGISTER) & 0x80  # AIE: bit 7
-        fired   = self._read(self._CONTROL2_REGISTER) & 0x40  # AF:  bit 6
+        control_2 = self._read(self._CONTROL2_REGISTER)
+        enabled = control_2 & 0x80                            # AIE: bit 7
+        fired   = control_2 & 0x40                            # AF:  bit 6
         return (bool(enabled),bool(fired))
     
+    @_locked
     def clear_alarm(self):
         """
         Clear the given alarm (set AF in the control_2-register to zero)
@@ -427,6 +1328,7 @@ class PCF85063A(object):
         control_2 &= ~0x40
         self._write(self._CONTROL2_REGISTER,control_2)
         
+    @_locked
     def set_alarm(self,state):
         """
         Set the alarm-flag AIE in the control2-register to the
@@ -436,12 +1338,104 @@ class PCF85063A(object):
         control_2 = _set_bit(control_2,7,state)
         self._write(self._CONTROL2_REGISTER,control_2)
 
+    #######################################################################
+    # countdown timer
+    ########################################################################
+
+    def set_timer(self,value,clock=TIMER_1HZ,interrupt=True,pulse=False):
+        """
+        Program and start the countdown timer. The timer counts down value
+        [1,255] periods of the clock source, sets TF and restarts. With
+        interrupt, the INT-pin follows TF (or generates a pulse if pulse
+        is set).
+        """
+        if value < 1 or value > 255:
+            raise ValueError('Timer value is out of range [1,255].')
+        if clock not in (self.TIMER_4096HZ,self.TIMER_64HZ,
+                         self.TIMER_1HZ,self.TIMER_1_60HZ):
+            raise ValueError('Invalid timer clock %r.' % clock)
+        mode = (clock << 3) | 0x04                  # TCF, TE
+        if interrupt:
+            mode |= 0x02                            # TIE
+        if pulse:
+            mode |= 0x01                            # TI_TP
+        with self:
+            self._write(self._TIMER_VALUE_REGISTER,value)
+            self._write(self._TIMER_MODE_REGISTER,mode)
+
+    def set_timer_period(self,seconds,interrupt=True,pulse=False):
+        """
+        Program and start the countdown timer with the given period in
+        seconds, using the finest clock source that can represent it.
+        """
+        for clock in (self.TIMER_4096HZ,self.TIMER_64HZ,
+                      self.TIMER_1HZ,self.TIMER_1_60HZ):
+            value = seconds * self.TIMER_FREQUENCIES[clock]
+            if value <= 255 and value == int(value) and value >= 1:
+                self.set_timer(int(value),clock,interrupt,pulse)
+                return
+        raise ValueError('Timer period %r s is not supported.' % seconds)
+
+    @_locked
+    def get_timer(self):
+        """
+        Query the countdown timer. Returns a tuple (value, clock, enabled,
+        interrupt, pulse) with the current countdown value.
+        """
+        value, mode = self._read_block(self._TIMER_VALUE_REGISTER,2)
+        return (value, (mode >> 3) & 0x03, bool(mode & 0x04),
+                bool(mode & 0x02), bool(mode & 0x01))
+
+    def get_timer_period(self):
+        """
+        Return the period of the countdown timer in seconds.
+        """
+        value, clock = self.get_timer()[:2]
+        return value / self.TIMER_FREQUENCIES[clock]
+
+    def get_timer_state(self):
+        """
+        Query the state of the timer. Returns a tuple (enabled,fired)
+        of two booleans.
+        """
+        with self:
+            enabled = self._read(self._TIMER_MODE_REGISTER) & 0x04  # TE
+            fired   = self._read(self._CONTROL2_REGISTER) & 0x08    # TF
+        return (bool(enabled),bool(fired))
+
+    @_locked
+    def stop_timer(self):
+        """
+        Stop the countdown timer (clear TE and TIE)
+        """
+        mode = self._read(self._TIMER_MODE_REGISTER)
+        self._write(self._TIMER_MODE_REGISTER,mode & ~0x06)
+
+    @_locked
+    def clear_timer(self):
+        """
+        Clear the timer flag (set TF in the control_2-register to zero)
+        """
+        control_2 = self._read(self._CONTROL2_REGISTER)
+        control_2 &= ~0x08
+        self._write(self._CONTROL2_REGISTER,control_2)
+
+    @_locked
+    def snapshot(self):
+        """
+        Read the complete register map with a single transaction and return
+        it as Snapshot.
+        """
+        return Snapshot(self._read_block(0x00, self._REGISTER_COUNT),
+                        self._utc)
+
     def dump_value(self,value):
         """
         Dump a value as hex and binary string
         """
         return "0x{0:02X} 0b{0:08b}".format(value,value)
     
+    @_locked
     def dump_register(self,reg):
         """
         Read and return a raw register as binary string
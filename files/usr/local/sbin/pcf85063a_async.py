@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# asyncio-API for the PCF85063A.
+#
+# All bus-transactions are executed by one executor-thread per bus, so
+# they are serialized and don't block the event-loop. Concurrent identical
+# reads (same method and arguments) share a single transaction. Ticks of
+# the RTC and fired alarms/timers can be awaited.
+#
+# Example:
+#
+#   rtc = pcf85063a_async.AsyncPCF85063A(10)
+#   print(await rtc.read_datetime())
+#   await rtc.set_alarm(1)
+#   await rtc.wait_for_alarm()
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import time, asyncio, concurrent.futures
+
+import pcf85063a
+
+# one executor (single thread) per bus
+_executors = {}
+
+def _executor(port):
+  """ return the executor of the given bus """
+  if port not in _executors:
+    _executors[port] = concurrent.futures.ThreadPoolExecutor(
+      max_workers=1,thread_name_prefix="i2c-%d" % port)
+  return _executors[port]
+
+def _reader(name):
+  """ create a coroutine-method for a read-only method of PCF85063A """
+  async def method(self,*args):
+    return await self.read(name,*args)
+  method.__name__ = name
+  method.__doc__  = getattr(pcf85063a.PCF85063A,name).__doc__
+  return method
+
+def _writer(name):
+  """ create a coroutine-method for a method of PCF85063A """
+  async def method(self,*args):
+    return await self.call(name,*args)
+  method.__name__ = name
+  method.__doc__  = getattr(pcf85063a.PCF85063A,name).__doc__
+  return method
+
+class AsyncPCF85063A(object):
+  """
+  asyncio-counterpart of PCF85063A. All methods of PCF85063A used below
+  are coroutines with the same arguments.
+  """
+
+  def __init__(self,port,utc=True,addr=pcf85063a.PCF85063A_ADDR,bus=None,
+               lock=None,rtc=None):
+    """
+    constructor: the arguments are passed to PCF85063A. Alternatively,
+    an existing PCF85063A-object can be passed as rtc.
+    """
+    self.rtc = rtc or pcf85063a.PCF85063A(port,utc,addr,bus=bus,lock=lock)
+    self._executor     = _executor(port)
+    self._inflight     = {}
+    self._tick_waiters = []
+    self._tick_task    = None
+
+  # --- execution   --------------------------------------------------------
+
+  async def run(self,func,*args):
+    """
+    Execute func(rtc,*args) in the executor of the bus, e.g. for a batch
+    of operations (with rtc: ...) that must not be interleaved.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor,func,self.rtc,*args)
+
+  async def call(self,name,*args):
+    """
+    Call the given method of PCF85063A in the executor of the bus.
+    """
+    return await self.run(lambda rtc: getattr(rtc,name)(*args))
+
+  async def read(self,name,*args):
+    """
+    Call the given read-only method of PCF85063A. Concurrent calls with
+    the same arguments share the result of a single call.
+    """
+    key = (name,) + args
+    future = self._inflight.get(key)
+    if future is None:
+      future = asyncio.ensure_future(self.call(name,*args))
+      self._inflight[key] = future
+      future.add_done_callback(lambda _: self._inflight.pop(key,None))
+    # a cancelled caller must not cancel the call of the others
+    return await asyncio.shield(future)
+
+  # --- methods of PCF85063A   ---------------------------------------------
+
+  read_all             = _reader("read_all")
+  read_str             = _reader("read_str")
+  read_datetime        = _reader("read_datetime")
+  snapshot             = _reader("snapshot")
+  get_offset           = _reader("get_offset")
+  get_time_valid       = _reader("get_time_valid")
+  get_alarm_time       = _reader("get_alarm_time")
+  get_alarm_state      = _reader("get_alarm_state")
+  get_timer            = _reader("get_timer")
+  get_timer_period     = _reader("get_timer_period")
+  get_timer_state      = _reader("get_timer_state")
+
+  write_all            = _writer("write_all")
+  write_datetime       = _writer("write_datetime")
+  write_system_datetime_now = _writer("write_system_datetime_now")
+  set_offset           = _writer("set_offset")
+  set_time_valid       = _writer("set_time_valid")
+  set_alarm_time       = _writer("set_alarm_time")
+  clear_alarm          = _writer("clear_alarm")
+  set_alarm            = _writer("set_alarm")
+  set_timer            = _writer("set_timer")
+  set_timer_period     = _writer("set_timer_period")
+  stop_timer           = _writer("stop_timer")
+  clear_timer          = _writer("clear_timer")
+
+  # --- ticks   ------------------------------------------------------------
+
+  async def _read_seconds_at(self):
+    """ read the seconds register, see PCF85063A._read_seconds_at() """
+    return await self.run(lambda rtc: rtc._read_seconds_at())
+
+  async def _poll_tick(self,last,t_last,interval,deadline):
+    """
+    Poll the seconds register until it differs from last. Returns a tuple
+    (value,t_last,t_now) with the last read before and the read after the
+    edge.
+    """
+    while True:
+      await asyncio.sleep(interval)
+      value, t_now = await self._read_seconds_at()
+      if value != last:
+        return (value,t_last,t_now)
+      if t_now > deadline:
+        raise TimeoutError('no tick of the RTC detected')
+      t_last = t_now
+
+  async def ticks(self,precision=0.001,guard=0.005):
+    """
+    Asynchronous generator following the ticks of the RTC, see
+    PCF85063A.watch(). Yields a tuple (system time, RTC time, error)
+    for every tick.
+    """
+    min_guard = guard
+    t_edge = None
+    while True:
+      if t_edge is None:
+        # coarse polling to find an edge
+        last, t_last = await self._read_seconds_at()
+        last, t_last, t_now = await self._poll_tick(last,t_last,0.05,
+                                                    t_last+3)
+        t_edge = (t_last + t_now)/2
+        delay = t_edge + 1 - guard - time.time()
+      else:
+        rtc_time = await self.run(lambda rtc: rtc._read_epoch())
+        yield (t_edge,rtc_time,error)
+        delay = t_edge + 1 - guard - time.time()
+
+      if delay > 0:
+        await asyncio.sleep(delay)
+      value, t_last = await self._read_seconds_at()
+      if value != last:
+        # woke up too late: resynchronize with a larger guard
+        min_guard = min(1.5*guard,0.25)
+        guard     = min(2*guard,0.25)
+        t_edge    = None
+        continue
+      last, t_last, t_now = await self._poll_tick(last,t_last,precision,
+                                                  t_last+2*guard+1)
+      t_edge, error = (t_last + t_now)/2, (t_now - t_last)/2
+      guard = max(0.9*guard,min_guard)
+
+  async def _follow_ticks(self):
+    """ deliver ticks to the waiters until no waiter is left """
+    try:
+      async for tick in self.ticks():
+        waiters, self._tick_waiters = self._tick_waiters, []
+        if not waiters:
+          break
+        for future in waiters:
+          if not future.done():
+            future.set_result(tick)
+    except Exception as ex:
+      waiters, self._tick_waiters = self._tick_waiters, []
+      for future in waiters:
+        if not future.done():
+          future.set_exception(ex)
+    finally:
+      self._tick_task = None
+
+  async def wait_for_tick(self):
+    """
+    Wait for the next tick of the RTC and return a tuple (system time,
+    RTC time, error), see ticks(). All waiters share a single task
+    following the ticks.
+    """
+    future = asyncio.get_running_loop().create_future()
+    self._tick_waiters.append(future)
+    if self._tick_task is None:
+      self._tick_task = asyncio.ensure_future(self._follow_ticks())
+    return await future
+
+  # --- alarm and timer   --------------------------------------------------
+
+  async def wait_for_alarm(self,interval=1.0):
+    """
+    Wait until the alarm fired (AF set), polling every interval seconds.
+    """
+    while not (await self.get_alarm_state())[1]:
+      await asyncio.sleep(interval)
+
+  async def wait_for_timer(self,interval=1.0):
+    """
+    Wait until the countdown timer fired (TF set), polling every interval
+    seconds.
+    """
+    while not (await self.get_timer_state())[1]:
+      await asyncio.sleep(interval)
+
+  async def close(self):
+    """ stop following the ticks (cancels all waiters) """
+    if self._tick_task:
+      self._tick_task.cancel()
+    waiters, self._tick_waiters = self._tick_waiters, []
+    for future in waiters:
+      future.cancel()
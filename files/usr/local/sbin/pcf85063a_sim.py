@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Software model of the RTC PCF85063A and a simulated SMBus.
+#
+# The model implements the register semantics of the chip (running clock,
+# stop-bit, alarm matching with masked alarm fields, flags that can only
+# be cleared, countdown timer, drift and offset-correction), so that
+# pcf85063a.py and cm4io_rtcctl.py can be run and benchmarked without
+# hardware. The simulated bus is a drop-in replacement for smbus.SMBus,
+# counts transactions and can add a configurable latency to every
+# transaction.
+#
+# Not modelled: 12h-mode, clock-output, the external test-mode. The
+# correction of the offset register is applied continuously instead of
+# with correction pulses every two hours (four minutes in coarse mode).
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import time, errno
+from datetime import datetime, timedelta
+
+PCF85063A_ADDR = 0x51
+
+# register values after power-on/software-reset
+_RESET_VALUES = [0x00, 0x00, 0x00, 0x00,              # control, offset, ram
+                 0x80, 0x00, 0x00, 0x01, 0x06, 0x01, 0x00,  # time (OS set)
+                 0x80, 0x80, 0x80, 0x80, 0x80,        # alarms (disabled)
+                 0x00, 0x18]                          # timer
+
+_REGISTER_COUNT = len(_RESET_VALUES)
+
+def _bcd(value):
+  """ encode value as BCD """
+  return ((value // 10) << 4) | (value % 10)
+
+def _dec(value):
+  """ decode a BCD value """
+  return (value >> 4)*10 + (value & 0x0F)
+
+def _days_in_month(month,year):
+  """ number of days of a month (the chip treats every year%4 as leap) """
+  if month == 2:
+    return 29 if year % 4 == 0 else 28
+  return 30 if month in (4,6,9,11) else 31
+
+# --- device model   -------------------------------------------------------
+
+class PCF85063ASim(object):
+  """
+  Register-level model of the PCF85063A.
+  """
+
+  CONTROL_1 = 0x00
+  CONTROL_2 = 0x01
+  SECONDS   = 0x04
+  ALARM_SEC = 0x0B
+
+  STOP_RELEASE_DELAY = 0.507874         # first increment after STOP=0
+
+  def __init__(self,dtime=None,clock=time.monotonic,drift=0.0):
+    """
+    constructor: dtime is the initial (naive) datetime of the RTC. Without
+    a datetime, the device starts with its reset values. clock is the
+    time-source used to run the clock. drift is the deviation of the
+    oscillator in ppm (positive: clock is fast).
+    """
+    self._clock   = clock
+    self.drift    = drift
+    self._skew    = 0.0                 # manual advance, see advance()
+    self.reset()
+    if dtime:
+      self.set_datetime(dtime)
+
+  def reset(self):
+    """ power-on/software reset """
+    self.regs     = list(_RESET_VALUES)
+    self._last    = self._now()
+    self._prescaler = 0.0                # fraction of current second
+    self._timer_reload = 0               # reload value of the timer
+    self._timer_acc    = 0.0             # fraction of current timer period
+
+  def _now(self):
+    """ current value of the time-source """
+    return self._clock() + self._skew
+
+  def advance(self,seconds):
+    """ advance the time-source (useful with a frozen clock) """
+    self._skew += seconds
+
+  # --- clock   ------------------------------------------------------------
+
+  def set_datetime(self,dtime):
+    """ set the time-registers from a datetime and clear the OS-flag """
+    self._update()
+    self.regs[4:11] = [_bcd(dtime.second), _bcd(dtime.minute),
+                       _bcd(dtime.hour), _bcd(dtime.day),
+                       dtime.isoweekday() % 7, _bcd(dtime.month),
+                       _bcd(dtime.year % 100)]
+    self._prescaler = 0.0
+
+  def get_datetime(self):
+    """ return the time-registers as datetime """
+    self._update()
+    return self.get_datetime_raw()
+
+  def _update(self):
+    """ run the clock up to the current time of the time-source """
+    now = self._now()
+    elapsed = now - self._last
+    self._last = now
+    if elapsed <= 0 or self.regs[self.CONTROL_1] & 0x20:   # STOP-bit
+      return
+    offset = self.regs[0x02] & 0x7F
+    if offset & 0x40:
+      offset -= 0x80
+    lsb = 4.069 if self.regs[0x02] & 0x80 else 4.34
+    elapsed *= 1 + (self.drift - offset*lsb)*1e-6     # positive: slower
+    self._run_timer(elapsed)
+    self._prescaler += elapsed
+    ticks = int(self._prescaler)
+    self._prescaler -= ticks
+    if ticks:
+      self._tick(ticks)
+
+  def _run_timer(self,elapsed):
+    """ count down the timer and set TF when it reaches zero """
+    mode = self.regs[0x11]
+    if not mode & 0x04 or not self._timer_reload:          # TE
+      return
+    freq = (4096, 64, 1, 1/60)[(mode >> 3) & 0x03]
+    self._timer_acc += elapsed * freq
+    ticks = int(self._timer_acc)
+    self._timer_acc -= ticks
+    count = self.regs[0x10]
+    if ticks < count:
+      self.regs[0x10] = count - ticks
+      return
+    self.regs[self.CONTROL_2] |= 0x08                      # TF
+    remaining = (ticks - count) % self._timer_reload
+    self.regs[0x10] = self._timer_reload - remaining
+
+  @property
+  def interrupt(self):
+    """ state of the INT-pin (True: active) """
+    c2, mode = self.regs[self.CONTROL_2], self.regs[0x11]
+    return bool((c2 & 0xC0 == 0xC0) or                    # AIE and AF
+                (c2 & 0x08 and mode & 0x03 == 0x02))       # TF, TIE, !TI_TP
+
+  def _alarm_enabled(self):
+    """ check if at least one alarm field is enabled """
+    return any(not self.regs[r] & 0x80 for r in range(0x0B,0x10))
+
+  def _tick(self,count):
+    """ advance the time-registers by count seconds """
+    if not self._alarm_enabled():
+      # fast path: nothing to check for every second
+      try:
+        dtime = self.get_datetime_raw() + timedelta(seconds=count)
+      except ValueError:
+        pass                             # invalid register values
+      else:
+        days = (self._secs_of_day() + count) // 86400
+        wday = ((self.regs[8] & 0x07) + days) % 7
+        os_flag = self.regs[self.SECONDS] & 0x80
+        self._write_time(dtime,wday)
+        self.regs[self.SECONDS] |= os_flag
+        return
+    for _ in range(count):
+      self._tick_one()
+      self._check_alarm()
+
+  def get_datetime_raw(self):
+    """ time-registers as datetime without running the clock """
+    r = self.regs
+    return datetime(2000+_dec(r[10]),_dec(r[9] & 0x1F),_dec(r[7] & 0x3F),
+                    _dec(r[6] & 0x3F),_dec(r[5] & 0x7F),_dec(r[4] & 0x7F))
+
+  def _secs_of_day(self):
+    """ seconds since midnight of the time-registers """
+    r = self.regs
+    return (_dec(r[6] & 0x3F)*3600 + _dec(r[5] & 0x7F)*60 +
+            _dec(r[4] & 0x7F))
+
+  def _write_time(self,dtime,wday):
+    """ update time-registers (keeps unused bits cleared) """
+    self.regs[4:11] = [_bcd(dtime.second), _bcd(dtime.minute),
+                       _bcd(dtime.hour), _bcd(dtime.day), wday,
+                       _bcd(dtime.month), _bcd(dtime.year % 100)]
+
+  def _tick_one(self):
+    """ advance the time-registers by one second (BCD-counter chain) """
+    r = self.regs
+    os_flag = r[4] & 0x80
+    sec, minute, hour = _dec(r[4] & 0x7F), _dec(r[5] & 0x7F), _dec(r[6] & 0x3F)
+    day, month, year  = _dec(r[7] & 0x3F), _dec(r[9] & 0x1F), _dec(r[10])
+    wday = r[8] & 0x07
+
+    sec += 1
+    if sec > 59:
+      sec = 0
+      minute += 1
+      if minute > 59:
+        minute = 0
+        hour += 1
+        if hour > 23:
+          hour = 0
+          wday = (wday+1) % 7
+          day += 1
+          if day > _days_in_month(month,year):
+            day = 1
+            month += 1
+            if month > 12:
+              month = 1
+              year = (year+1) % 100
+    r[4:11] = [os_flag | _bcd(sec), _bcd(minute), _bcd(hour), _bcd(day),
+               wday, _bcd(month), _bcd(year)]
+
+  def _check_alarm(self):
+    """ set AF if all enabled alarm fields match the time-registers """
+    r = self.regs
+    fields = ((0x0B,4,0x7F), (0x0C,5,0x7F), (0x0D,6,0x3F),
+              (0x0E,7,0x3F), (0x0F,8,0x07))
+    enabled = False
+    for alarm,reg,mask in fields:
+      if r[alarm] & 0x80:
+        continue
+      enabled = True
+      if (r[alarm] & mask) != (r[reg] & mask):
+        return
+    if enabled:
+      r[self.CONTROL_2] |= 0x40
+
+  # --- register access   --------------------------------------------------
+
+  def read(self,register,length):
+    """ read length registers (address wraps after the last register) """
+    self._update()
+    return [self.regs[(register+i) % _REGISTER_COUNT] for i in range(length)]
+
+  def write(self,register,data):
+    """ write registers (address wraps after the last register) """
+    self._update()
+    for i,value in enumerate(data):
+      self._write_register((register+i) % _REGISTER_COUNT,value & 0xFF)
+
+  def _write_register(self,register,value):
+    """ write a single register with the semantics of the chip """
+    if register == self.CONTROL_1:
+      if value == 0x58:                  # software-reset command
+        self.reset()
+        return
+      value &= 0xA7                      # SR and unused bits read 0
+      if value & 0x20:
+        self._prescaler = 0.0            # STOP resets the divider chain
+      elif self.regs[register] & 0x20:
+        # released: first increment after STOP_RELEASE_DELAY
+        self._prescaler = 1.0 - self.STOP_RELEASE_DELAY
+    elif register == self.CONTROL_2:
+      # AF and TF can only be cleared
+      flags = self.regs[register] & 0x48
+      value = (value & ~0x48) | (flags & value)
+    elif register == 0x10:
+      self._timer_reload = value         # timer value and reload value
+      self._timer_acc    = 0.0
+    elif register == 0x11 and value & 0x04 and not self.regs[0x11] & 0x04:
+      self._timer_acc    = 0.0           # timer (re)started
+    self.regs[register] = value
+
+# --- system clock   -------------------------------------------------------
+
+def stub_clock_settime():
+  """
+  Replace time.clock_settime() with a stub, so that commands run against
+  the simulated device never change the clock of the host. Returns the
+  list receiving the arguments (clock,time) of every call.
+  """
+  calls = []
+  time.clock_settime = lambda clock,value: calls.append((clock,value))
+  return calls
+
+# --- simulated bus   ------------------------------------------------------
+
+class SimBus(object):
+  """
+  Drop-in replacement for smbus.SMBus talking to simulated devices.
+  """
+
+  def __init__(self,devices=None,latency=0.0):
+    """
+    constructor: devices is a dict address->device. Without devices, a
+    PCF85063A with the current UTC-time is created. latency is the time
+    in seconds added to every transaction.
+    """
+    if devices is None:
+      devices = {PCF85063A_ADDR: PCF85063ASim(datetime.utcnow())}
+    self.devices      = devices
+    self.latency      = latency
+    self.transactions = 0
+    self.bytes        = 0
+
+  def _device(self,addr,count):
+    """ account a transaction and return the device """
+    self.transactions += 1
+    self.bytes        += count
+    if self.latency:
+      time.sleep(self.latency)
+    try:
+      return self.devices[addr]
+    except KeyError:
+      raise OSError(errno.EREMOTEIO,"Remote I/O error")
+
+  def reset_counters(self):
+    """ reset transaction and byte counters """
+    self.transactions = 0
+    self.bytes        = 0
+
+  def read_byte_data(self,addr,register):
+    return self._device(addr,2).read(register,1)[0]
+
+  def write_byte_data(self,addr,register,value):
+    self._device(addr,2).write(register,[value])
+
+  def read_i2c_block_data(self,addr,register,length=32):
+    return self._device(addr,1+length).read(register,length)
+
+  def write_i2c_block_data(self,addr,register,data):
+    self._device(addr,1+len(data)).write(register,data)
+
+  def close(self):
+    pass
@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Instrumentation of the PCF85063A-driver.
+#
+# InstrumentedBus wraps the bus of a PCF85063A and counts transactions,
+# bytes, errors and the latency of every transaction (per register). The
+# driver reports the duration of its high-level operations (public methods
+# and batches). collect() adds the state of the RTC (offset to the system
+# time, alarm, timer). The statistics can be exported as textfile for the
+# textfile-collector of the prometheus node_exporter or as json.
+#
+# Instrumentation is off unless a Stats-object is passed to the driver
+# (see PCF85063A.set_stats()).
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, time, threading
+
+# upper bounds of the latency-buckets (seconds)
+TRANSACTION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                       0.01, 0.025, 0.05, 0.1)
+OPERATION_BUCKETS   = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PREFIX = "rtcctl_"
+
+class Histogram(object):
+  """
+  Histogram of durations with fixed buckets.
+  """
+
+  __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+  def __init__(self,buckets):
+    self.buckets = buckets
+    self.counts  = [0] * len(buckets)
+    self.count   = 0
+    self.sum     = 0.0
+
+  def observe(self,value):
+    """ add a value """
+    self.count += 1
+    self.sum   += value
+    for i,bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        break
+
+  def cumulative(self):
+    """ return a list of (upper bound, cumulative count) including +Inf """
+    result, total = [], 0
+    for bound,count in zip(self.buckets,self.counts):
+      total += count
+      result.append((bound,total))
+    result.append((float("inf"),self.count))
+    return result
+
+  def to_dict(self):
+    return {"count": self.count, "sum": self.sum,
+            "buckets": {_format_bound(bound): count
+                        for bound,count in self.cumulative()}}
+
+def _format_bound(bound):
+  """ format the upper bound of a bucket like prometheus """
+  return "+Inf" if bound == float("inf") else repr(bound)
+
+class Stats(object):
+  """
+  Statistics of the bus-traffic, the operations and the state of a RTC.
+  """
+
+  def __init__(self,labels=None):
+    """
+    constructor: labels is a dict of labels added to every metric (e.g.
+    bus and address of the RTC)
+    """
+    self.labels       = dict(labels or {})
+    self.transactions = {}              # (kind,register) -> [count,bytes,
+                                        #                     errors,histogram]
+    self.operations   = {}              # name -> histogram
+    self.gauges       = {}              # name -> value
+    self._mutex       = threading.Lock()
+    self._local       = threading.local()
+
+  def observe_transaction(self,kind,register,count,seconds,error=False):
+    """ account a bus-transaction """
+    key = (kind,register)
+    with self._mutex:
+      entry = self.transactions.get(key)
+      if entry is None:
+        entry = self.transactions[key] = [0,0,0,Histogram(TRANSACTION_BUCKETS)]
+      entry[0] += 1
+      entry[1] += count
+      entry[2] += bool(error)
+      entry[3].observe(seconds)
+
+  def observe_operation(self,name,seconds):
+    """ account a high-level operation """
+    with self._mutex:
+      histogram = self.operations.get(name)
+      if histogram is None:
+        histogram = self.operations[name] = Histogram(OPERATION_BUCKETS)
+      histogram.observe(seconds)
+
+  def enter(self,name):
+    """
+    Start of an operation. Nested operations are accounted as part of
+    the outermost operation.
+    """
+    local = self._local
+    depth = getattr(local,"depth",0)
+    if not depth:
+      local.name  = name
+      local.start = time.perf_counter()
+    local.depth = depth + 1
+
+  def leave(self):
+    """ end of an operation (see enter()) """
+    local = self._local
+    local.depth -= 1
+    if not local.depth:
+      self.observe_operation(local.name,time.perf_counter()-local.start)
+
+  def set_gauge(self,name,value):
+    """ set the value of a gauge """
+    self.gauges[name] = value
+
+  # --- export   -----------------------------------------------------------
+
+  def to_dict(self):
+    """ return all statistics as dict (e.g. for json) """
+    with self._mutex:
+      return {
+        "labels": self.labels,
+        "transactions": [
+          {"kind": kind, "register": "0x%02x" % register, "count": count,
+           "bytes": nbytes, "errors": errors, "latency": histogram.to_dict()}
+          for (kind,register),(count,nbytes,errors,histogram)
+          in sorted(self.transactions.items())],
+        "operations": {name: histogram.to_dict()
+                       for name,histogram in sorted(self.operations.items())},
+        "gauges": dict(self.gauges)}
+
+  def _labels(self,**extra):
+    """ format the labels of a sample """
+    labels = dict(self.labels,**extra)
+    if not labels:
+      return ""
+    return "{%s}" % ",".join('%s="%s"' % (key,value)
+                             for key,value in sorted(labels.items()))
+
+  def to_prometheus(self):
+    """ return all statistics in the text-format of prometheus """
+    lines = []
+    def header(name,kind,text):
+      lines.append("# HELP %s%s %s" % (PREFIX,name,text))
+      lines.append("# TYPE %s%s %s" % (PREFIX,name,kind))
+    def histogram(name,hist,**labels):
+      for bound,count in hist.cumulative():
+        lines.append("%s%s_bucket%s %d" %
+                     (PREFIX,name,self._labels(le=_format_bound(bound),
+                                               **labels),count))
+      lines.append("%s%s_sum%s %.9f" % (PREFIX,name,self._labels(**labels),
+                                        hist.sum))
+      lines.append("%s%s_count%s %d" % (PREFIX,name,self._labels(**labels),
+                                        hist.count))
+
+    with self._mutex:
+      transactions = sorted(self.transactions.items())
+      operations   = sorted(self.operations.items())
+      gauges       = sorted(self.gauges.items())
+
+    for index,(name,text) in enumerate(
+        [("i2c_transactions_total","Number of i2c-transactions."),
+         ("i2c_bytes_total","Number of bytes transferred (incl. register)."),
+         ("i2c_errors_total","Number of failed i2c-transactions.")]):
+      header(name,"counter",text)
+      for (kind,register),entry in transactions:
+        lines.append("%s%s%s %d" %
+                     (PREFIX,name,self._labels(kind=kind,
+                                               register="0x%02x" % register),
+                      entry[index]))
+    header("i2c_transaction_seconds","histogram",
+           "Latency of i2c-transactions.")
+    for (kind,register),entry in transactions:
+      histogram("i2c_transaction_seconds",entry[3],kind=kind,
+                register="0x%02x" % register)
+    header("operation_seconds","histogram","Duration of driver-operations.")
+    for name,hist in operations:
+      histogram("operation_seconds",hist,operation=name)
+    for name,value in gauges:
+      header(name,"gauge","State of the RTC: %s." % name.replace("_"," "))
+      lines.append("%s%s%s %s" % (PREFIX,name,self._labels(),repr(value)))
+    return "\n".join(lines) + "\n"
+
+  def write_textfile(self,path):
+    """
+    Write the statistics in the text-format of prometheus. The file is
+    replaced atomically, as required by the textfile-collector.
+    """
+    tmp = path + ".tmp"
+    with open(tmp,"w") as f:
+      f.write(self.to_prometheus())
+    os.replace(tmp,path)
+
+# --- instrumented bus   ---------------------------------------------------
+
+class InstrumentedBus(object):
+  """
+  Wrapper of a bus (interface of smbus.SMBus) accounting every
+  transaction in a Stats-object.
+  """
+
+  def __init__(self,bus,stats):
+    self.bus   = bus
+    self.stats = stats
+
+  def _call(self,kind,register,count,func,*args):
+    """ execute and account a transaction """
+    start = time.perf_counter()
+    try:
+      result = func(*args)
+    except OSError:
+      self.stats.observe_transaction(kind,register,count,
+                                     time.perf_counter()-start,True)
+      raise
+    self.stats.observe_transaction(kind,register,count,
+                                   time.perf_counter()-start)
+    return result
+
+  def read_byte_data(self,addr,register):
+    return self._call("read",register,2,self.bus.read_byte_data,addr,register)
+
+  def write_byte_data(self,addr,register,value):
+    return self._call("write",register,2,self.bus.write_byte_data,
+                      addr,register,value)
+
+  def read_i2c_block_data(self,addr,register,length=32):
+    return self._call("read",register,1+length,self.bus.read_i2c_block_data,
+                      addr,register,length)
+
+  def write_i2c_block_data(self,addr,register,data):
+    return self._call("write",register,1+len(data),
+                      self.bus.write_i2c_block_data,addr,register,data)
+
+  def close(self):
+    self.bus.close()
+
+# --- state of the RTC   ---------------------------------------------------
+
+def collect(rtc,stats,offset=True):
+  """
+  Update the gauges with the state of the RTC (one snapshot). With offset,
+  the offset of the RTC to the system time is measured (waits for the
+  next tick of the RTC).
+  """
+  snap = rtc.snapshot()
+  stats.set_gauge("alarm_enabled",int(snap.aie))
+  stats.set_gauge("alarm_fired",int(snap.af))
+  stats.set_gauge("timer_enabled",int(snap.timer_enabled))
+  stats.set_gauge("timer_fired",int(snap.tf))
+  stats.set_gauge("oscillator_stop",int(snap.oscillator_stop))
+  stats.set_gauge("time_valid",int(snap.time_valid()))
+  if offset:
+    stats.set_gauge("offset_seconds",rtc.measure_offset())
+  lock = rtc.lock_stats()
+  if lock:
+    stats.set_gauge("lock_acquisitions",lock[0])
+    stats.set_gauge("lock_contended",lock[1])
+    stats.set_gauge("lock_wait_seconds",lock[2])
+    stats.set_gauge("lock_wait_max_seconds",lock[3])
+  stats.set_gauge("last_update_seconds",time.time())
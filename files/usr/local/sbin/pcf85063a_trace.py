@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Recording and replay of bus-transactions.
+#
+# TraceBus wraps a bus (interface of smbus.SMBus) and records every
+# transaction in a compact binary file:
+#
+#   header: b"RTCT" + version-byte
+#   record: time (8 bytes, float, seconds since the epoch), duration
+#           (4 bytes, microseconds), operation (1 byte, bit 7: failed),
+#           address (1 byte), register (1 byte), length of data (1 byte),
+#           data (read or written bytes, errno for failed transactions)
+#
+# ReplayBus feeds a recorded trace back into PCF85063A without hardware.
+# As long as the driver issues the recorded transactions, reads return the
+# recorded data. Transactions which are not in the trace are served from
+# an image of the registers reconstructed from the trace, so changed
+# drivers can be replayed and compared (see diff()). Note that the
+# replayed data is independent of the system time, i.e. waiting for a
+# tick of the RTC only works if the driver polls like the recorded one.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import time, errno, struct, threading
+
+_MAGIC  = b"RTCT\x01"
+_RECORD = struct.Struct(">dIBBBB")
+
+# operations (methods of the bus)
+OPERATIONS = ("read_byte_data", "write_byte_data",
+              "read_i2c_block_data", "write_i2c_block_data")
+_FAILED = 0x80
+
+_REGISTER_COUNT = 0x12             # address-pointer wraps from 0x11 to 0x00
+
+class Transaction(object):
+  """
+  A recorded bus-transaction.
+  """
+
+  __slots__ = ('time', 'duration', 'op', 'addr', 'register', 'data', 'error')
+
+  def __init__(self,when,duration,op,addr,register,data,error=None):
+    self.time     = when             # seconds since the epoch
+    self.duration = duration         # seconds
+    self.op       = op               # index into OPERATIONS
+    self.addr     = addr
+    self.register = register
+    self.data     = bytes(data)      # read or written bytes
+    self.error    = error            # errno of a failed transaction
+
+  def is_read(self):
+    return not self.op & 1
+
+  def key(self):
+    """
+    Identification of the transaction for comparisons: operation, address,
+    register and the written data (reads only compare the length)
+    """
+    if self.error is not None:
+      return (self.op,self.addr,self.register,None)
+    return (self.op,self.addr,self.register,
+            len(self.data) if self.is_read() else self.data)
+
+  def matches(self,key):
+    """ check if the transaction matches the given key (see key()) """
+    own = self.key()
+    return own == key or (self.error is not None and own[:3] == key[:3])
+
+  def __str__(self):
+    name = OPERATIONS[self.op].replace("_data","").replace("i2c_","")
+    if self.error is not None:
+      data = "error %d" % self.error
+    else:
+      data = " ".join("%02x" % b for b in self.data)
+    return "%-16s 0x%02x 0x%02x %8.3fms  %s" % (
+      name,self.addr,self.register,1000*self.duration,data)
+
+# --- file format   --------------------------------------------------------
+
+def load(path):
+  """ read a trace-file and return a list of transactions """
+  with open(path,"rb") as f:
+    data = f.read()
+  if not data.startswith(_MAGIC):
+    raise ValueError("invalid trace-file %s" % path)
+
+  transactions = []
+  pos = len(_MAGIC)
+  while pos + _RECORD.size <= len(data):
+    when, duration, op, addr, register, length = _RECORD.unpack_from(data,pos)
+    pos += _RECORD.size
+    payload = data[pos:pos+length]
+    pos += length
+    if op & _FAILED:
+      transactions.append(Transaction(when,duration/1e6,op & ~_FAILED,addr,
+                                      register,b"",payload[0]))
+    else:
+      transactions.append(Transaction(when,duration/1e6,op,addr,register,
+                                      payload))
+  return transactions
+
+class TraceBus(object):
+  """
+  Wrapper of a bus recording every transaction in a trace-file.
+  """
+
+  def __init__(self,bus,path):
+    """ constructor: path is the trace-file (overwritten) """
+    self.bus    = bus
+    self._file  = open(path,"wb")
+    self._mutex = threading.Lock()
+    self._file.write(_MAGIC)
+
+  def _record(self,op,addr,register,data,when,start,error=None):
+    """ append a transaction to the trace-file """
+    duration = int((time.perf_counter()-start)*1e6)
+    if error is not None:
+      op, data = op | _FAILED, bytes([error & 0xFF])
+    elif isinstance(data,int):
+      data = bytes([data])
+    else:
+      data = bytes(data)
+    with self._mutex:
+      if self._file:
+        self._file.write(_RECORD.pack(when,duration,op,addr,register,
+                                      len(data)) + data)
+
+  def _call(self,op,addr,register,data,func,*args):
+    """ execute and record a transaction """
+    when, start = time.time(), time.perf_counter()
+    try:
+      result = func(*args)
+    except OSError as ex:
+      self._record(op,addr,register,b"",when,start,ex.errno or errno.EIO)
+      raise
+    self._record(op,addr,register,data if result is None else result,
+                 when,start)
+    return result
+
+  def read_byte_data(self,addr,register):
+    return self._call(0,addr,register,None,self.bus.read_byte_data,
+                      addr,register)
+
+  def write_byte_data(self,addr,register,value):
+    return self._call(1,addr,register,[value],self.bus.write_byte_data,
+                      addr,register,value)
+
+  def read_i2c_block_data(self,addr,register,length=32):
+    return self._call(2,addr,register,None,self.bus.read_i2c_block_data,
+                      addr,register,length)
+
+  def write_i2c_block_data(self,addr,register,data):
+    return self._call(3,addr,register,data,self.bus.write_i2c_block_data,
+                      addr,register,data)
+
+  def flush(self):
+    """ write buffered records to the trace-file """
+    with self._mutex:
+      if self._file:
+        self._file.flush()
+
+  def close(self):
+    """ close the trace-file and the bus """
+    with self._mutex:
+      if self._file:
+        self._file.close()
+        self._file = None
+    self.bus.close()
+
+# --- replay   -------------------------------------------------------------
+
+class ReplayBus(object):
+  """
+  Bus replaying a recorded trace (drop-in replacement for smbus.SMBus).
+  """
+
+  def __init__(self,transactions,latency=False,lookahead=16):
+    """
+    constructor: transactions is a list of recorded transactions (see
+    load()). With latency, every transaction takes as long as the
+    recorded one. lookahead is the number of recorded transactions
+    skipped to find a match for a transaction of the driver.
+    """
+    self.recorded  = transactions
+    self.replayed  = []               # transactions issued by the driver
+    self.latency   = latency
+    self.lookahead = lookahead
+    self._pos      = 0
+    self._image    = {}               # addr -> register-values
+
+    # registers start with the first value seen in the trace
+    for trans in reversed(transactions):
+      self._apply(trans)
+
+  def _apply(self,trans):
+    """ update the register-image with the data of a transaction """
+    if trans.error is not None:
+      return
+    regs = self._image.setdefault(trans.addr,[0] * _REGISTER_COUNT)
+    for i,value in enumerate(trans.data):
+      regs[(trans.register+i) % _REGISTER_COUNT] = value
+
+  def _match(self,key):
+    """
+    Find the next recorded transaction with the given key (within the
+    lookahead). Skipped transactions update the register-image.
+    """
+    end = min(self._pos+self.lookahead,len(self.recorded))
+    for pos in range(self._pos,end):
+      if self.recorded[pos].matches(key):
+        for skipped in self.recorded[self._pos:pos]:
+          self._apply(skipped)
+        self._pos = pos + 1
+        return self.recorded[pos]
+    return None
+
+  def _transfer(self,op,addr,register,data=None,length=0):
+    """ execute a transaction, returns the read bytes """
+    if data is not None:
+      data = bytes(data)
+      key  = (op,addr,register,data)
+    else:
+      key  = (op,addr,register,length)
+    trans = self._match(key)
+    if trans is None:
+      # not in the trace: use the register-image
+      regs = self._image.setdefault(addr,[0] * _REGISTER_COUNT)
+      if data is None:
+        data = bytes(regs[(register+i) % _REGISTER_COUNT]
+                     for i in range(length))
+      trans = Transaction(time.time(),0.0,op,addr,register,data)
+    elif self.latency:
+      time.sleep(trans.duration)
+    self._apply(trans)
+    self.replayed.append(Transaction(time.time(),trans.duration,op,addr,
+                                     register,trans.data,trans.error))
+    if trans.error is not None:
+      raise OSError(trans.error,"recorded error")
+    return trans.data
+
+  def read_byte_data(self,addr,register):
+    return self._transfer(0,addr,register,length=1)[0]
+
+  def write_byte_data(self,addr,register,value):
+    self._transfer(1,addr,register,data=[value])
+
+  def read_i2c_block_data(self,addr,register,length=32):
+    return list(self._transfer(2,addr,register,length=length))
+
+  def write_i2c_block_data(self,addr,register,data):
+    self._transfer(3,addr,register,data=data)
+
+  def close(self):
+    pass
+
+  def diff(self):
+    """
+    Compare the transactions of the driver with the recorded ones.
+    Returns a list of tuples (tag,recorded,replayed) with the tags of
+    difflib.SequenceMatcher (equal, replace, delete, insert) and the
+    lists of affected transactions.
+    """
+    import difflib
+
+    recorded = self.recorded
+    replayed = self.replayed
+    matcher  = difflib.SequenceMatcher(None,
+                                       [t.key() for t in recorded],
+                                       [t.key() for t in replayed],
+                                       autojunk=False)
+    return [(tag,recorded[i1:i2],replayed[j1:j2])
+            for tag,i1,i2,j1,j2 in matcher.get_opcodes()]
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Benchmark and check of the BCD-conversion of pcf85063a.py.
+#
+# The lookup tables of the driver are compared bit-exact with the original
+# bit-loop implementation (kept here as reference): all 256 inputs of the
+# decoder, all 100 inputs of the encoder and the block-decoder with the
+# masks of the time registers. The script then reports the time per call
+# of both implementations and the speedup. It fails if a result differs
+# or if the speedup is below the given minimum.
+#
+# Usage: tools/bench_bcd.py [-n number] [-m speedup]
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, sys, random, timeit, argparse
+
+SBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "..","files","usr","local","sbin")
+sys.path.insert(0,SBIN)
+import pcf85063a
+
+# --- reference (original bit-loop implementation)   -----------------------
+
+def _bcd_to_int(bcd):
+  """
+  Decode a 2x4bit BCD to a integer.
+  """
+  out = 0
+  for digit in (bcd >> 4, bcd):
+    for value in (1, 2, 4, 8):
+      if digit & 1:
+        out += value
+      digit >>= 1
+    out *= 10
+  return int(out/10)
+
+def _int_to_bcd(number):
+  """
+  Encode a one or two digits number to the BCD format.
+  """
+  bcd = 0
+  for idx in (number // 10, number % 10):
+    for value in (8, 4, 2, 1):
+      if idx >= value:
+        bcd += 1
+        idx -= value
+      bcd <<= 1
+  return bcd >> 1
+
+def _bcd_block_to_int(regs,masks):
+  """ decode a block of BCD registers with the reference decoder """
+  return [_bcd_to_int(reg & mask) for reg,mask in zip(regs,masks)]
+
+# --- checks   -------------------------------------------------------------
+
+def check():
+  """ compare the driver with the reference, returns a list of errors """
+  errors = []
+  for bcd in range(256):
+    if pcf85063a._bcd_to_int(bcd) != _bcd_to_int(bcd):
+      errors.append("decode 0x%02x: %d != %d" %
+                    (bcd,pcf85063a._bcd_to_int(bcd),_bcd_to_int(bcd)))
+  for number in range(100):
+    if pcf85063a._int_to_bcd(number) != _int_to_bcd(number):
+      errors.append("encode %d: 0x%02x != 0x%02x" %
+                    (number,pcf85063a._int_to_bcd(number),
+                     _int_to_bcd(number)))
+
+  # every register value at every position of the time registers
+  masks = pcf85063a.PCF85063A._TIME_MASKS
+  for value in range(256):
+    regs = [value] * len(masks)
+    if (pcf85063a._bcd_block_to_int(regs,masks) !=
+        _bcd_block_to_int(regs,masks)):
+      errors.append("block 0x%02x: %s != %s" %
+                    (value,pcf85063a._bcd_block_to_int(regs,masks),
+                     _bcd_block_to_int(regs,masks)))
+  return errors
+
+# --- benchmark   ----------------------------------------------------------
+
+def bench(stmt,number,env):
+  """ return the time per call of stmt in seconds (best of five) """
+  return min(timeit.repeat(stmt,number=number,repeat=5,globals=env))/number
+
+# --- main program   -------------------------------------------------------
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="BCD-conversion benchmark")
+  parser.add_argument("-n","--number",type=int,default=100000,
+                      help="number of calls per measurement (default: 100000)")
+  parser.add_argument("-m","--min-speedup",type=float,default=1.0,
+                      help="minimal speedup of the driver (default: 1.0)")
+  options = parser.parse_args()
+
+  errors = check()
+  for error in errors[:10]:
+    print("FAILED: %s" % error)
+  print("bit-exact check: %s\n" % ("FAILED" if errors else "ok"))
+
+  rnd   = random.Random(1)
+  regs  = [rnd.randrange(256) for _ in range(7)]
+  env   = {"ref": sys.modules[__name__], "drv": pcf85063a,
+           "regs": regs, "masks": pcf85063a.PCF85063A._TIME_MASKS}
+  cases = [("decode",     "ref._bcd_to_int(0x59)",
+                          "drv._bcd_to_int(0x59)"),
+           ("encode",     "ref._int_to_bcd(59)",
+                          "drv._int_to_bcd(59)"),
+           ("time block", "ref._bcd_block_to_int(regs,masks)",
+                          "drv._bcd_block_to_int(regs,masks)")]
+
+  failed = bool(errors)
+  print("%-12s %11s %11s %8s  %s" % ("conversion","reference","driver",
+                                     "speedup","result"))
+  for name,ref,drv in cases:
+    t_ref = bench(ref,options.number,env)
+    t_drv = bench(drv,options.number,env)
+    ok = t_ref/t_drv >= options.min_speedup
+    failed = failed or not ok
+    print("%-12s %9.3fus %9.3fus %7.1fx  %s" %
+          (name,1e6*t_ref,1e6*t_drv,t_ref/t_drv,"ok" if ok else "FAILED"))
+
+  sys.exit(1 if failed else 0)
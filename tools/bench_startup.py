@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Benchmark of the startup time of the scripts.
+#
+# Every command is run several times in a new interpreter (cold start, but
+# with compiled bytecode like on an installed system) against the simulated
+# RTC (see pcf85063a_sim.py). The script reports the wall-clock time above
+# the startup time of a bare interpreter and the time spent in imports
+# (from python3 -X importtime) and fails if a command exceeds its budget.
+#
+# Usage: tools/bench_startup.py [-n runs] [-f factor] [-v]
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, sys, time, shutil, tempfile, subprocess, statistics, argparse
+import compileall
+
+SBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "..","files","usr","local","sbin")
+
+# commands and their budget (ms above the startup of a bare interpreter)
+CASES = [
+  ("help",            ["cm4io_rtcctl.py","help"],                     20),
+  ("show date",       ["cm4io_rtcctl.py","show","date"],              30),
+  ("show --json",     ["cm4io_rtcctl.py","show","--json"],            40),
+  ("dump",            ["cm4io_rtcctl.py","dump"],                     30),
+  ("set alarm",       ["cm4io_rtcctl.py","set","alarm","01.01.2030"], 30),
+  ("on_boot",         ["cm4io_rtcctl.on_boot.py"],                    30),
+  ]
+
+# --- run a command   ------------------------------------------------------
+
+def run(argv,cwd,env):
+  """
+  Run python3 with the given arguments and return a tuple (wall-time,
+  imports) with the time in seconds and a dict module->cumulative time of
+  the top-level imports in seconds
+  """
+  start = time.perf_counter()
+  proc = subprocess.run([sys.executable,"-X","importtime"] + argv,cwd=cwd,
+                        env=env,stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE,text=True)
+  wall = time.perf_counter() - start
+  if proc.returncode:
+    raise RuntimeError("%s failed:\n%s" % (" ".join(argv),proc.stderr))
+
+  imports = {}
+  for line in proc.stderr.splitlines():
+    if not line.startswith("import time:") or "cumulative" in line:
+      continue
+    _, cumulative, name = line[12:].split("|")
+    if not name[1:].startswith(" "):               # top-level import
+      imports[name.strip()] = int(cumulative)/1e6
+  return (wall,imports)
+
+def measure(argv,cwd,env,runs):
+  """
+  Run a command several times (after one warm-up run) and return a tuple
+  (median wall-time, median import-time, imports of the last run)
+  """
+  run(argv,cwd,env)
+  walls, totals = [], []
+  for _ in range(runs):
+    wall, imports = run(argv,cwd,env)
+    walls.append(wall)
+    totals.append(sum(imports.values()))
+  return (statistics.median(walls),statistics.median(totals),imports)
+
+# --- main program   -------------------------------------------------------
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="startup-time benchmark")
+  parser.add_argument("-n","--runs",type=int,default=10,
+                      help="number of runs per command (default: 10)")
+  parser.add_argument("-f","--factor",type=float,default=1.0,
+                      help="scale all budgets (e.g. for slower systems)")
+  parser.add_argument("-v","--verbose",action="store_true",
+                      help="list the most expensive imports of every command")
+  options = parser.parse_args()
+
+  env = dict(os.environ,RTCCTL_SIM="0")
+  env.pop("PYTHONDONTWRITEBYTECODE",None)
+  failed = False
+
+  with tempfile.TemporaryDirectory() as tmp:
+    # private copy with compiled bytecode
+    for name in os.listdir(SBIN):
+      if name.endswith(".py"):
+        shutil.copy(os.path.join(SBIN,name),tmp)
+    compileall.compile_dir(tmp,quiet=1)
+
+    base_wall, base_imports, _ = measure(["-c","pass"],tmp,env,options.runs)
+    print("baseline (python3 -c pass): %.1fms, imports %.1fms\n" %
+          (1000*base_wall,1000*base_imports))
+    print("%-16s %9s %9s %9s  %s" % ("command","wall","imports","budget",
+                                     "result"))
+    for name,argv,budget in CASES:
+      wall, imports, details = measure(argv,tmp,env,options.runs)
+      wall    -= base_wall
+      imports -= base_imports
+      budget  *= options.factor
+      ok = 1000*wall <= budget
+      failed = failed or not ok
+      print("%-16s %7.1fms %7.1fms %7.1fms  %s" %
+            (name,1000*wall,1000*imports,budget,"ok" if ok else "FAILED"))
+      if options.verbose:
+        top = sorted(details.items(),key=lambda item: -item[1])[:5]
+        for module,cumulative in top:
+          print("%16s   %-24s %7.1fms" % ("",module,1000*cumulative))
+
+  sys.exit(1 if failed else 0)
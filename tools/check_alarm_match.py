@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Check the alarm matching of pcf85063a.py against a brute-force reference.
+#
+# For every combination of alarm fields, the reference walks minute by
+# minute through a range of several years and marks every minute matching
+# the enabled fields (disabled fields match every value, days not matching
+# day-of-month and weekday are skipped as a whole). Sweeps backward
+# and forward over all minutes then give the next and the previous
+# matching minute for every minute of the range. _alarm_match() (closed
+# form) must return the same datetime for the next alarm (alarm did not
+# fire) and for the last alarm (alarm fired).
+#
+# All 31 combinations of enabled fields (including weekday alarms) are
+# checked with random values. The checked times are random minutes plus
+# the minutes around every match and around the start of every month and
+# year. The script fails if there is a difference.
+#
+# Usage: tools/check_alarm_match.py [-s year] [-y years] [-n combinations]
+#                                   [-c checks] [-r seed]
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, sys, random, argparse
+from array import array
+from datetime import date, datetime, timedelta
+
+SBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "..","files","usr","local","sbin")
+sys.path.insert(0,SBIN)
+import pcf85063a
+
+LIMITS = (60, 60, 24, 31, 7)         # sec, min, hour, day, weekday
+
+# --- brute-force reference   ----------------------------------------------
+
+class Reference(object):
+  """
+  Next and previous matching minute for every minute of a range of days.
+  """
+
+  def __init__(self,fields,first,days):
+    sec, minute, hour, day, wday = fields
+    self.first = datetime(first.year,first.month,first.day)
+    self.sec   = sec
+    count      = 1440*days
+
+    # walk minute by minute and mark matching minutes
+    self.match = bytearray(count)
+    for d in range(days):
+      current = first + timedelta(days=d)
+      if ((day is not None and current.day != day) or
+          (wday is not None and current.toordinal() % 7 != wday)):  # 0: sun
+        continue                           # no minute of the day matches
+      for i in range(1440):
+        if ((minute is None or i % 60 == minute) and
+            (hour is None or i // 60 == hour)):
+          self.match[1440*d+i] = 1
+
+    # next (backward sweep) and previous (forward sweep) matching minute
+    self.next = array('l',[-1]) * (count+1)
+    self.prev = array('l',[-1]) * (count+1)
+    last = -1
+    for i in range(count-1,-1,-1):
+      if self.match[i]:
+        last = i
+      self.next[i] = last
+    last = -1
+    for i in range(count):
+      if self.match[i]:
+        last = i
+      self.prev[i+1] = last
+    self.prev[0] = -1
+
+  def _datetime(self,minute,second):
+    """ datetime of a minute of the range (None: outside of the range) """
+    if minute < 0:
+      return None
+    return self.first + timedelta(minutes=minute,seconds=second)
+
+  def next_alarm(self,i,second):
+    """ first alarm after second of minute i """
+    if self.sec is None:
+      if self.match[i] and second < 59:
+        return self._datetime(i,second+1)
+      return self._datetime(self.next[i+1],0)
+    if self.match[i] and second < self.sec:
+      return self._datetime(i,self.sec)
+    return self._datetime(self.next[i+1],self.sec)
+
+  def last_alarm(self,i,second):
+    """ last alarm up to second of minute i """
+    if self.sec is None:
+      if self.match[i]:
+        return self._datetime(i,second)
+      return self._datetime(self.prev[i],59)
+    if self.match[i] and second >= self.sec:
+      return self._datetime(i,self.sec)
+    return self._datetime(self.prev[i],self.sec)
+
+# --- checks   -------------------------------------------------------------
+
+def random_fields(rnd,pattern):
+  """ random alarm fields, bit n of pattern enables field n """
+  fields = []
+  for n,limit in enumerate(LIMITS):
+    if not pattern & (1 << n):
+      fields.append(None)
+    elif n == 3:
+      fields.append(rnd.choice([1,28,29,30,31,rnd.randint(1,31)]))
+    else:
+      fields.append(rnd.randrange(limit))
+  return tuple(fields)
+
+def check_points(rnd,ref,first,days,checks):
+  """ minutes to check: random, around matches and around month starts """
+  count  = 1440*days
+  points = {rnd.randrange(count) for _ in range(checks)}
+  matches = [i for i in range(count) if ref.match[i]]
+  for i in rnd.sample(matches,min(len(matches),checks)):
+    points.update((i-1,i,i+1))
+  for d in range(days):
+    if (first + timedelta(days=d)).day == 1:
+      points.update(range(1440*d-2,1440*d+2))
+  return sorted(i for i in points if 0 <= i < count)
+
+def check(fields,first,days,checks,rnd):
+  """ compare _alarm_match() with the reference, returns the differences """
+  ref = Reference(fields,first,days)
+  errors  = []
+  seconds = [0,59,rnd.randrange(60)]
+  if fields[0] is not None:
+    seconds += [max(fields[0]-1,0),fields[0],min(fields[0]+1,59)]
+  for i in check_points(rnd,ref,first,days,checks):
+    for second in seconds:
+      now = ref._datetime(i,second)
+      for fired in (False,True):
+        if fired:
+          expected = ref.last_alarm(i,second)
+        else:
+          expected = ref.next_alarm(i,second)
+        if expected is None:
+          continue                           # outside of the range
+        result = pcf85063a._alarm_match(fields,now,fired)
+        if result != expected:
+          errors.append((fields,now,fired,expected,result))
+  return errors
+
+# --- main program   -------------------------------------------------------
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="check alarm matching")
+  parser.add_argument("-s","--start",type=int,default=2024,
+                      help="first year of the range (default: 2024)")
+  parser.add_argument("-y","--years",type=int,default=4,
+                      help="number of years (default: 4)")
+  parser.add_argument("-n","--combinations",type=int,default=2,
+                      help="random values per combination of enabled "
+                      "fields (default: 2)")
+  parser.add_argument("-c","--checks",type=int,default=500,
+                      help="random minutes checked per combination "
+                      "(default: 500)")
+  parser.add_argument("-r","--seed",type=int,default=1,
+                      help="seed of the random generator (default: 1)")
+  options = parser.parse_args()
+
+  rnd   = random.Random(options.seed)
+  first = date(options.start,1,1)
+  days  = (date(options.start+options.years,1,1) - first).days
+
+  if pcf85063a._alarm_match((None,)*5,datetime(options.start,1,1),False):
+    print("FAILED: alarm without enabled fields")
+    sys.exit(1)
+
+  failed = 0
+  for pattern in range(1,32):
+    for _ in range(options.combinations):
+      fields = random_fields(rnd,pattern)
+      errors = check(fields,first,days,options.checks,rnd)
+      print("%-28s %s" % (fields,"FAILED" if errors else "ok"),flush=True)
+      for fields,now,fired,expected,result in errors[:5]:
+        print("  now %s fired=%s: expected %s, got %s" %
+              (now,fired,expected,result))
+      failed += bool(errors)
+
+  print("%d combination(s) failed" % failed)
+  sys.exit(1 if failed else 0)
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# --------------------------------------------------------------------------
+# Replay a trace of bus-transactions (see pcf85063a_trace.py).
+#
+# The script (e.g. cm4io_rtcctl.on_boot.py or cm4io_rtcctl.py with its
+# arguments) runs against the recorded trace instead of the hardware and
+# the transactions of the driver are compared with the recorded ones. This
+# allows to benchmark changes of the driver against traces recorded in
+# the field. The system time is never changed during a replay.
+#
+# Usage: tools/replay_trace.py [-l] [-v] [-s] trace [script [args...]]
+#
+# Without script, the trace is listed.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/cm4io_rtcctl
+#
+# --------------------------------------------------------------------------
+
+import os, sys, time, runpy, argparse
+
+SBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "..","files","usr","local","sbin")
+
+# --- helpers   ------------------------------------------------------------
+
+def summary(name,transactions,wall=None):
+  """ print number of transactions, bytes and bus-time """
+  nbytes = sum(len(t.data) + 1 for t in transactions)
+  bus    = sum(t.duration for t in transactions)
+  line   = "%-9s %5d transactions %6d bytes, bus %8.2fms" % (
+    name,len(transactions),nbytes,1000*bus)
+  if wall is not None:
+    line += ", total %8.2fms" % (1000*wall)
+  print(line)
+
+def replay(trace,argv,latency):
+  """
+  Run the script with the given arguments against the trace. Returns a
+  tuple (bus,wall-time).
+  """
+  sys.path.insert(0,os.path.dirname(os.path.abspath(argv[0])))
+  sys.path.insert(1,SBIN)
+  import pcf85063a, pcf85063a_trace
+
+  replay_bus = pcf85063a_trace.ReplayBus(trace,latency=latency)
+
+  class ReplayPCF85063A(pcf85063a.PCF85063A):
+    """ PCF85063A always using the replay-bus """
+    def __init__(self,port,utc=True,addr=pcf85063a.PCF85063A_ADDR,
+                 bus=None,lock=None,stats=None):
+      super().__init__(port,utc,addr,bus=replay_bus,stats=stats)
+
+  pcf85063a.PCF85063A = ReplayPCF85063A
+  time.clock_settime = lambda clock,value: None       # keep the system time
+  os.environ["RTCCTL_SIM"] = "0"                      # no daemon, no lock
+
+  sys.argv = list(argv)
+  start = time.perf_counter()
+  try:
+    runpy.run_path(argv[0],run_name="__main__")
+  except SystemExit:
+    pass
+  return (replay_bus,time.perf_counter()-start)
+
+# --- main program   -------------------------------------------------------
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="replay a trace of the bus")
+  parser.add_argument("-l","--latency",action="store_true",
+                      help="reproduce the recorded latency of the bus")
+  parser.add_argument("-v","--verbose",action="store_true",
+                      help="list all differences (default: at most 10)")
+  parser.add_argument("-s","--strict",action="store_true",
+                      help="fail if the transactions differ from the trace")
+  parser.add_argument("trace",help="trace-file (--trace of the scripts)")
+  parser.add_argument("script",nargs=argparse.REMAINDER,
+                      help="script and its arguments")
+  options = parser.parse_args()
+
+  sys.path.insert(0,SBIN)
+  import pcf85063a_trace
+  trace = pcf85063a_trace.load(options.trace)
+
+  if not options.script:
+    for trans in trace:
+      print("%.6f %s" % (trans.time,trans))
+    summary("recorded",trace)
+    sys.exit(0)
+
+  # replay, output of the script is shown as is
+  bus, wall = replay(trace,options.script,options.latency)
+  sys.stdout.flush()
+
+  print("")
+  summary("recorded",trace)
+  summary("replayed",bus.replayed,wall)
+  changes = [change for change in bus.diff() if change[0] != "equal"]
+  removed = sum(len(recorded) for _,recorded,_ in changes)
+  added   = sum(len(replayed) for _,_,replayed in changes)
+  print("differences: %d removed, %d added" % (removed,added))
+
+  limit = None if options.verbose else 10
+  for tag,recorded,replayed in changes[:limit]:
+    print("--- %s" % tag)
+    for trans in recorded:
+      print("- %s" % trans)
+    for trans in replayed:
+      print("+ %s" % trans)
+  if limit and len(changes) > limit:
+    print("... %d more (use -v)" % (len(changes)-limit))
+
+  sys.exit(1 if options.strict and changes else 0)